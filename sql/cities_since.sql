@@ -0,0 +1,12 @@
+-- Distinct cities with raw rows since `ts`.
+-- Used by src/api_pipeline.py (fetch_unique_cities) so city discovery is one
+-- small server-side DISTINCT instead of paging every recent row.
+create or replace function cities_since(ts timestamptz)
+returns table(city text)
+language sql
+stable
+as $$
+    select distinct city
+    from air_quality_data
+    where datetime_utc >= ts
+$$;
@@ -0,0 +1,24 @@
+-- Supabase (Postgres) indexes for the hot lookup paths.
+-- The local SQLite table needs none: its UNIQUE(city, datetime_utc)
+-- autoindex already serves "WHERE city = ? ORDER BY datetime_utc DESC LIMIT 1".
+
+-- Per-city latest rows: dashboard load_city_data / latest_aqi_per_city
+-- (DISTINCT ON (city) ... ORDER BY city, datetime_utc DESC) become index seeks.
+-- Also the arbiter for the pipeline's upsert(on_conflict="city,datetime_utc").
+--
+-- Rows written before the pipeline upserted on (city, datetime_utc) were
+-- keyed on id, so hourly runs could store several rows for one reading.
+-- Keep the newest (max id) of each pair first, or the unique index fails.
+delete from aqi_results a
+using aqi_results b
+where a.city = b.city
+  and a.datetime_utc = b.datetime_utc
+  and a.id < b.id;
+
+create unique index if not exists aqi_results_city_datetime_utc_key
+    on aqi_results (city, datetime_utc desc);
+
+-- Recent-window scans over raw rows: cities_since(ts) and the pipeline's
+-- fetch_recent_rows (datetime_utc >= since).
+create index if not exists air_quality_data_datetime_utc_idx
+    on air_quality_data (datetime_utc);
@@ -0,0 +1,13 @@
+-- Latest aqi_results row for each requested city.
+-- Used by src/dashboard.py (load_latest_rows) so the overview/map tabs need
+-- one round-trip instead of one query per city.
+create or replace function latest_aqi_per_city(cities text[])
+returns setof aqi_results
+language sql
+stable
+as $$
+    select distinct on (city) *
+    from aqi_results
+    where city = any(cities)
+    order by city, datetime_utc desc
+$$;
@@ -0,0 +1,30 @@
+-- Local SQLite schema (db/air_quality.db), applied by src/db.py:ensure_schema.
+-- Connection PRAGMAs (WAL etc.) live in src/db.py:connect, since journal_mode
+-- can't change inside a script's transaction.
+CREATE TABLE IF NOT EXISTS air_quality_data (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    city TEXT NOT NULL,
+    datetime_utc TEXT NOT NULL,
+    datetime_ist TEXT NOT NULL,
+    temperature_2m REAL,
+    relative_humidity_2m REAL,
+    dew_point_2m REAL,
+    apparent_temperature REAL,
+    pressure_msl REAL,
+    surface_pressure REAL,
+    cloudcover REAL,
+    windspeed_10m REAL,
+    winddirection_10m REAL,
+    pm10 REAL,
+    pm2_5 REAL,
+    carbon_monoxide REAL,
+    carbon_dioxide REAL,
+    nitrogen_dioxide REAL,
+    sulphur_dioxide REAL,
+    ozone REAL,
+    uv_index REAL,
+    uv_index_clear_sky REAL,
+    ammonia REAL,
+    methane REAL,
+    UNIQUE(city, datetime_utc)  -- prevent duplicates for same city & timestamp
+);
@@ -1,20 +1,29 @@
-from fastapi import FastAPI, HTTPException
-from .utils import fetch_data, fetch_city_predictions
+from contextlib import asynccontextmanager
 
-app = FastAPI(title="Air Quality API", version="1.0")
+from fastapi import FastAPI, HTTPException, Request
+from .utils import fetch_data, fetch_city_predictions, get_supabase_client
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # One Supabase client per worker, created before requests are accepted
+    # instead of a new client (and TLS handshake) on every request.
+    app.state.supabase = get_supabase_client()
+    yield
+
+app = FastAPI(title="Air Quality API", version="1.0", lifespan=lifespan)
 
 @app.get("/")
 def root():
     return {"message": "Air Quality API is running!"}
 
 @app.get("/raw")
-def get_raw_data(limit: int = 100):
-    df = fetch_data("air_quality_data", limit=limit)
+def get_raw_data(request: Request, limit: int = 100):
+    df = fetch_data("air_quality_data", limit=limit, client=request.app.state.supabase)
     return df.to_dict(orient="records")
 
 @app.get("/predictions/{city}")
-def get_city_predictions(city: str, limit: int = 100):
-    df = fetch_city_predictions(city, limit=limit)
+def get_city_predictions(request: Request, city: str, limit: int = 100):
+    df = fetch_city_predictions(city, limit=limit, client=request.app.state.supabase)
     if df.empty:
         raise HTTPException(status_code=404, detail=f"No predictions found for {city}")
     return df.to_dict(orient="records")
@@ -6,23 +6,25 @@ Production-ready AQI pipeline:
 - Builds engineered features used at training
 - Loads models (city-specific fallback to generic) and forecasts 1h/2h/3h
 - Classifies AQI categories
-- Detects anomalies (rolling z-score; IsolationForest fallback)
+- Detects anomalies (rolling z-score; median/MAD fallback)
 - Writes results into `aqi_results` (dynamic schema detection + upsert)
 """
 
 import os
 import sys
 import math
+import functools
 import pickle
 import logging
+import warnings
 from datetime import datetime, timedelta, timezone
 
+import httpx
 import numpy as np
 import pandas as pd
 from dotenv import load_dotenv
-from supabase import create_client, Client
-from sklearn.ensemble import IsolationForest
-from catboost import CatBoostRegressor
+from supabase import create_client, Client, ClientOptions
+# catboost is imported lazily inside the helper that needs it
 
 # ---- Init ----
 load_dotenv()
@@ -38,7 +40,18 @@ if not SUPABASE_URL or not SUPABASE_SERVICE_KEY:
     logging.error("SUPABASE_URL and SUPABASE_SERVICE_KEY must be set (env or .env).")
     sys.exit(1)
 
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_SERVICE_KEY)
+# Shared HTTP client handed to supabase-py through its supported `httpx_client`
+# option (postgrest sets base_url/headers on it). A longer keep-alive lets the
+# pipeline's sequential calls reuse one TLS connection instead of re-handshaking.
+_http_client = httpx.Client(
+    http2=True,
+    follow_redirects=True,
+    timeout=120,  # postgrest's default; it isn't applied to a caller-supplied client
+    limits=httpx.Limits(max_keepalive_connections=16, keepalive_expiry=60),
+)
+supabase: Client = create_client(
+    SUPABASE_URL, SUPABASE_SERVICE_KEY, options=ClientOptions(httpx_client=_http_client)
+)
 
 # expected raw columns in air_quality_data (your schema)
 RAW_COLS = [
@@ -50,41 +63,65 @@ RAW_COLS = [
     "nitrogen_dioxide", "sulphur_dioxide", "ozone",
     "uv_index", "uv_index_clear_sky", "methane"
 ]
+# raw measurement columns (everything except identifiers/timestamps)
+NUMERIC_COLS = [c for c in RAW_COLS if c not in ("id", "city", "datetime_utc", "datetime_ist")]
+
+# gases summed into the `sum_gases` feature (NaN counts as 0)
+GAS_COLS = ["carbon_monoxide", "carbon_dioxide", "nitrogen_dioxide", "sulphur_dioxide", "ozone", "methane"]
+
+# CPCB subindex columns produced by compute_aqi_block (order breaks dominant-pollutant ties)
+INDEX_COLS = [
+    "pm2_5_index", "pm10_index", "nitrogen_dioxide_index",
+    "sulphur_dioxide_index", "carbon_monoxide_index", "ozone_index",
+]
+# raw pollutants echoed into aqi_results as latest_<col>
+LATEST_COLS = ["pm2_5", "pm10", "nitrogen_dioxide", "sulphur_dioxide", "carbon_monoxide", "ozone"]
+
+# projection for raw fetches; falls back to "*" (once per process) if the table lacks a column
+_raw_select = ",".join(RAW_COLS)
 
 # -------------------------
 # AQI: CPCB-style subindex helpers
 # -------------------------
-def _linear_subindex(C, bp):
-    if C is None or (isinstance(C, float) and math.isnan(C)):
-        return np.nan
-    for Clow, Chigh, Ilow, Ihigh in bp:
-        if Clow <= C <= Chigh:
-            return ((Ihigh - Ilow) / (Chigh - Clow)) * (C - Clow) + Ilow
-    return np.nan
+_BP_PM25 = np.array([(0,30,0,50),(31,60,51,100),(61,90,101,200),(91,120,201,300),(121,250,301,400),(251,500,401,500)], dtype=np.float64)  # µg/m³
+_BP_PM10 = np.array([(0,50,0,50),(51,100,51,100),(101,250,101,200),(251,350,201,300),(351,430,301,400),(431,600,401,500)], dtype=np.float64)
+_BP_NO2 = np.array([(0,40,0,50),(41,80,51,100),(81,180,101,200),(181,280,201,300),(281,400,301,400),(401,600,401,500)], dtype=np.float64)
+_BP_SO2 = np.array([(0,40,0,50),(41,80,51,100),(81,380,101,200),(381,800,201,300),(801,1600,301,400),(1601,2000,401,500)], dtype=np.float64)
+_BP_CO = np.array([(0.0,1.0,0,50),(1.1,2.0,51,100),(2.1,10.0,101,200),(10.1,17.0,201,300),(17.1,34.0,301,400),(34.1,50.0,401,500)], dtype=np.float64)
+_BP_O3 = np.array([(0,50,0,50),(51,100,51,100),(101,168,101,200),(169,208,201,300),(209,748,301,500),(749,1000,401,500)], dtype=np.float64)
+
+def _linear_subindex(C, bp: np.ndarray) -> np.ndarray:
+    """Vectorized breakpoint interpolation over an array of concentrations."""
+    c = np.asarray(C, dtype=np.float64)
+    clow, chigh, ilow, ihigh = bp.T
+    # first bucket whose upper bound is >= C (clipped so NaN / overflow still index safely)
+    idx = np.minimum(np.searchsorted(chigh, c, side="left"), len(bp) - 1)
+    lo, hi, il, ih = clow[idx], chigh[idx], ilow[idx], ihigh[idx]
+    sub = ((ih - il) / (hi - lo)) * (c - lo) + il
+    # NaN, out-of-range and gaps between buckets have no subindex
+    return np.where((c >= lo) & (c <= hi), sub, np.nan)
 
 def aqi_pm25(c):  # CPCB breakpoints µg/m³
-    bp = [(0,30,0,50),(31,60,51,100),(61,90,101,200),(91,120,201,300),(121,250,301,400),(251,500,401,500)]
-    return _linear_subindex(c, bp)
+    return _linear_subindex(c, _BP_PM25)
 
 def aqi_pm10(c):
-    bp = [(0,50,0,50),(51,100,51,100),(101,250,101,200),(251,350,201,300),(351,430,301,400),(431,600,401,500)]
-    return _linear_subindex(c, bp)
+    return _linear_subindex(c, _BP_PM10)
 
 def aqi_no2(c):
-    bp = [(0,40,0,50),(41,80,51,100),(81,180,101,200),(181,280,201,300),(281,400,301,400),(401,600,401,500)]
-    return _linear_subindex(c, bp)
+    return _linear_subindex(c, _BP_NO2)
 
 def aqi_so2(c):
-    bp = [(0,40,0,50),(41,80,51,100),(81,380,101,200),(381,800,201,300),(801,1600,301,400),(1601,2000,401,500)]
-    return _linear_subindex(c, bp)
+    return _linear_subindex(c, _BP_SO2)
 
 def aqi_co(c):
-    bp = [(0.0,1.0,0,50),(1.1,2.0,51,100),(2.1,10.0,101,200),(10.1,17.0,201,300),(17.1,34.0,301,400),(34.1,50.0,401,500)]
-    return _linear_subindex(c, bp)
+    return _linear_subindex(c, _BP_CO)
 
 def aqi_o3(c):
-    bp = [(0,50,0,50),(51,100,51,100),(101,168,101,200),(169,208,201,300),(209,748,301,500),(749,1000,401,500)]
-    return _linear_subindex(c, bp)
+    return _linear_subindex(c, _BP_O3)
+
+# category bins for the vectorized path; right-closed to match aqi_category's `<=` checks
+_AQI_BINS = [-np.inf, 50, 100, 200, 300, 400, np.inf]
+_AQI_LABELS = ["Good", "Satisfactory", "Moderate", "Poor", "Very Poor", "Severe"]
 
 def aqi_category(aqi):
     if pd.isna(aqi): return None
@@ -99,57 +136,66 @@ def aqi_category(aqi):
 # -------------------------
 # Feature engineering (mirror training)
 # -------------------------
-def engineer_features(df: pd.DataFrame) -> pd.DataFrame:
-    df = df.copy()
+def engineer_features(df: pd.DataFrame, needed: set | None = None) -> pd.DataFrame:
+    """Add training-time features. If `needed` is given, only derived columns
+    in it are computed (None computes everything). Expects NUMERIC_COLS to be
+    numeric already (see process_city)."""
+    def want(*cols):
+        return needed is None or any(c in needed for c in cols)
+
+    df = df.copy(deep=False)  # only adds/replaces columns
     # ensure datetime and sort
     df["datetime_utc"] = pd.to_datetime(df["datetime_utc"], utc=True, errors="coerce")
     df = df.sort_values("datetime_utc").reset_index(drop=True)
 
     # pressure diff
-    df["pressure_diff"] = df["pressure_msl"].astype(float) - df["surface_pressure"].astype(float)
+    if want("pressure_diff"):
+        df["pressure_diff"] = df["pressure_msl"] - df["surface_pressure"]
 
     # sum gases (simple sum of measured gases)
-    df["sum_gases"] = (
-        df["carbon_monoxide"].astype(float).fillna(0) +
-        df["carbon_dioxide"].astype(float).fillna(0) +
-        df["nitrogen_dioxide"].astype(float).fillna(0) +
-        df["sulphur_dioxide"].astype(float).fillna(0) +
-        df["ozone"].astype(float).fillna(0) +
-        df["methane"].astype(float).fillna(0)
-    )
+    if want("sum_gases"):
+        df["sum_gases"] = df[GAS_COLS].sum(axis=1, skipna=True)
 
     # rolling means (24 entries window assumed hourly; min_periods=1 to allow partial windows)
-    df["rolling_mean_pm2_5_24h"] = df["pm2_5"].astype(float).rolling(window=24, min_periods=1).mean()
-    df["rolling_mean_pm10_24h"] = df["pm10"].astype(float).rolling(window=24, min_periods=1).mean()
-
-    # pollutant ratio
-    df["pollutant_ratio_pm2_5_pm10"] = df.apply(
-        lambda r: (float(r["pm2_5"]) / float(r["pm10"])) if (pd.notna(r["pm2_5"]) and pd.notna(r["pm10"]) and float(r["pm10"]) != 0) else np.nan,
-        axis=1
-    )
+    # both windows go through one rolling pass over a 2-column frame
+    rolling = {src: f"rolling_mean_{src}_24h" for src in ("pm2_5", "pm10") if want(f"rolling_mean_{src}_24h")}
+    if rolling:
+        means = df[list(rolling)].rolling(window=24, min_periods=1).mean()
+        for src, dst in rolling.items():
+            df[dst] = means[src]
+
+    # pollutant ratio (zero pm10 -> NaN, NaN inputs propagate)
+    if want("pollutant_ratio_pm2_5_pm10"):
+        pm10 = df["pm10"]
+        df["pollutant_ratio_pm2_5_pm10"] = df["pm2_5"] / pm10.where(pm10 != 0)
 
     # temperature range
-    if "temperature_2m" in df.columns and "dew_point_2m" in df.columns:
-        df["temp_range"] = df["temperature_2m"].astype(float) - df["dew_point_2m"].astype(float)
-        df["humidity_temp_interaction"] = df["relative_humidity_2m"].astype(float) * df["temp_range"].astype(float)
-    else:
-        df["temp_range"] = np.nan
-        df["humidity_temp_interaction"] = np.nan
+    if want("temp_range", "humidity_temp_interaction"):
+        if "temperature_2m" in df.columns and "dew_point_2m" in df.columns:
+            df["temp_range"] = df["temperature_2m"] - df["dew_point_2m"]
+            df["humidity_temp_interaction"] = df["relative_humidity_2m"] * df["temp_range"]
+        else:
+            df["temp_range"] = np.nan
+            df["humidity_temp_interaction"] = np.nan
 
     # time features
-    df["hour"] = df["datetime_utc"].dt.hour
-    df["day_of_week"] = df["datetime_utc"].dt.weekday
-    df["month"] = df["datetime_utc"].dt.month
+    if want("hour"):
+        df["hour"] = df["datetime_utc"].dt.hour
+    if want("day_of_week"):
+        df["day_of_week"] = df["datetime_utc"].dt.weekday
+    if want("month"):
+        df["month"] = df["datetime_utc"].dt.month
 
     # wind category (low/medium/high): thresholds (m/s)
-    if "windspeed_10m" in df.columns:
-        df["wind_speed_category"] = pd.cut(
-            df["windspeed_10m"].astype(float),
-            bins=[-0.1, 2.5, 6, np.inf],
-            labels=["low", "medium", "high"],
-        )
-    else:
-        df["wind_speed_category"] = np.nan
+    if want("wind_speed_category"):
+        if "windspeed_10m" in df.columns:
+            df["wind_speed_category"] = pd.cut(
+                df["windspeed_10m"],
+                bins=[-0.1, 2.5, 6, np.inf],
+                labels=["low", "medium", "high"],
+            )
+        else:
+            df["wind_speed_category"] = np.nan
 
     return df
 
@@ -157,32 +203,22 @@ def engineer_features(df: pd.DataFrame) -> pd.DataFrame:
 # AQI compute block
 # -------------------------
 def compute_aqi_block(df: pd.DataFrame) -> pd.DataFrame:
-    df = df.copy()
-    df["pm2_5_index"] = df["pm2_5"].astype(float).apply(aqi_pm25)
-    df["pm10_index"] = df["pm10"].astype(float).apply(aqi_pm10)
-    df["nitrogen_dioxide_index"] = df["nitrogen_dioxide"].astype(float).apply(aqi_no2)
-    df["sulphur_dioxide_index"] = df["sulphur_dioxide"].astype(float).apply(aqi_so2)
-    df["carbon_monoxide_index"] = df["carbon_monoxide"].astype(float).apply(aqi_co)
-    df["ozone_index"] = df["ozone"].astype(float).apply(aqi_o3)
-
-    subcols = [
-        "pm2_5_index",
-        "pm10_index",
-        "nitrogen_dioxide_index",
-        "sulphur_dioxide_index",
-        "carbon_monoxide_index",
-        "ozone_index",
-    ]
+    df = df.copy(deep=False)  # only adds/replaces columns
+    df["pm2_5_index"] = aqi_pm25(df["pm2_5"].to_numpy(dtype=float))
+    df["pm10_index"] = aqi_pm10(df["pm10"].to_numpy(dtype=float))
+    df["nitrogen_dioxide_index"] = aqi_no2(df["nitrogen_dioxide"].to_numpy(dtype=float))
+    df["sulphur_dioxide_index"] = aqi_so2(df["sulphur_dioxide"].to_numpy(dtype=float))
+    df["carbon_monoxide_index"] = aqi_co(df["carbon_monoxide"].to_numpy(dtype=float))
+    df["ozone_index"] = aqi_o3(df["ozone"].to_numpy(dtype=float))
+
+    subcols = INDEX_COLS
     df["aqi"] = df[subcols].max(axis=1, skipna=True)
-    df["aqi_category"] = df["aqi"].apply(aqi_category)
-
-    # dominant pollutant (column name)
-    def _dominant(r):
-        cand = {c: r.get(c, np.nan) for c in subcols}
-        cand = {k: v for k, v in cand.items() if pd.notna(v)}
-        return max(cand, key=cand.get) if cand else None
+    df["aqi_category"] = pd.cut(df["aqi"], bins=_AQI_BINS, labels=_AQI_LABELS)
 
-    df["dominant_pollutant"] = df.apply(_dominant, axis=1)
+    # dominant pollutant (column name); None when every subindex is NaN
+    sub = df[subcols]
+    dom = sub.fillna(-np.inf).idxmax(axis=1).astype(object)
+    df["dominant_pollutant"] = dom.where(sub.notna().any(axis=1), None)
     return df
 
 # -------------------------
@@ -206,26 +242,35 @@ def load_model(city: str, horizon: str):
     for p in attempts:
         if os.path.exists(p):
             try:
-                if p.endswith(".pkl"):
-                    with open(p, "rb") as f:
-                        return pickle.load(f)
-                else:
-                    m = CatBoostRegressor()
-                    m.load_model(p)
-                    return m
+                return _load_model_file(p)
             except Exception as e:
                 logging.warning("Failed to load model %s: %s", p, e)
     return None
 
+@functools.lru_cache(maxsize=128)
+def _load_model_file(path: str):
+    """Load a model file once per path so cities sharing a generic model share one object."""
+    if path.endswith(".pkl"):
+        with open(path, "rb") as f:
+            return pickle.load(f)
+    from catboost import CatBoostRegressor
+    m = CatBoostRegressor()
+    m.load_model(path)
+    return m
+
+def model_feature_names(model) -> list[str] | None:
+    """Feature names the model was trained on, or None if it doesn't expose them."""
+    if hasattr(model, "feature_names_") and getattr(model, "feature_names_", None):
+        return list(model.feature_names_)
+    if hasattr(model, "feature_names_in_"):
+        return list(model.feature_names_in_)
+    return None
+
 def align_features_to_model(X: pd.DataFrame, model) -> pd.DataFrame:
     if model is None:
         return X.copy()
     X_al = X.copy()
-    model_features = None
-    if hasattr(model, "feature_names_") and getattr(model, "feature_names_", None):
-        model_features = list(model.feature_names_)
-    elif hasattr(model, "feature_names_in_"):
-        model_features = list(model.feature_names_in_)
+    model_features = model_feature_names(model)
     if model_features is None:
         return X_al
     # drop extras & add missing with 0
@@ -238,36 +283,59 @@ def align_features_to_model(X: pd.DataFrame, model) -> pd.DataFrame:
     X_al = X_al[model_features]
     return X_al
 
+def to_model_input(X_model: pd.DataFrame, model):
+    """Contiguous float32 array for CatBoost models without categorical features
+    (CatBoost bins features as float32 anyway); the DataFrame otherwise."""
+    get_cat = getattr(model, "get_cat_feature_indices", None)
+    if get_cat is None or get_cat():
+        return X_model
+    return np.ascontiguousarray(X_model.to_numpy(dtype=np.float32))
+
 # -------------------------
 # Anomaly helpers
 # -------------------------
 def rolling_z_anomaly(arr: np.ndarray, threshold=2.5, min_points=8):
     if len(arr) < min_points:
         return None
-    s = pd.Series(arr)
-    mean = s[:-1].mean()
-    std = s[:-1].std(ddof=0)
+    hist = arr[:-1]
+    mean = np.nanmean(hist)
+    std = np.nanstd(hist)
     if std == 0 or np.isnan(std):
         return None
-    z = (s.iloc[-1] - mean) / std
+    z = (arr[-1] - mean) / std
     return bool(abs(z) > threshold)
 
-def isolation_anomaly(arr: np.ndarray, contamination=0.05):
-    if len(arr) < 8:
+def mad_anomaly(arr: np.ndarray, k=3.5, min_points=8):
+    """Robust z-score of the last point against the median/MAD of the rest.
+
+    Replaces an IsolationForest fit, which is far too heavy for 8-24 points.
+    """
+    a = arr[~np.isnan(arr)]
+    if a.size < min_points:
         return None
-    iso = IsolationForest(contamination=contamination, random_state=42)
-    labels = iso.fit_predict(arr.reshape(-1, 1))
-    return labels[-1] == -1
+    hist = a[:-1]
+    med = np.median(hist)
+    mad = np.median(np.abs(hist - med))
+    if mad == 0:
+        # flat history: any departure from it is anomalous
+        return bool(a[-1] != med)
+    return bool(abs(a[-1] - med) / (1.4826 * mad) > k)
 
 # -------------------------
 # Dynamic schema fetch (best-effort)
 # -------------------------
+_SCHEMA_CACHE: dict[str, set] = {}
+
 def get_table_columns(table_name: str) -> set:
+    # Successful lookups are cached for the life of the process
+    if table_name in _SCHEMA_CACHE:
+        return _SCHEMA_CACHE[table_name]
     # Fetch one row to learn keys
     try:
         resp = supabase.table(table_name).select("*").limit(1).execute()
         if resp.data and isinstance(resp.data, list):
-            return set(resp.data[0].keys())
+            _SCHEMA_CACHE[table_name] = set(resp.data[0].keys())
+            return _SCHEMA_CACHE[table_name]
     except Exception as e:
         logging.warning("Failed to get columns for %s, falling back to a safe set: %s", table_name, e)
     # Fallback to a conservative set of expected columns
@@ -280,14 +348,31 @@ def get_table_columns(table_name: str) -> set:
         "dominant_pollutant","aqi_category"
     }
 
+get_table_columns.cache_clear = _SCHEMA_CACHE.clear
+
 # -------------------------
-# NEW: Robust unique-city discovery (paginates to avoid PostgREST page cap)
+# NEW: Robust unique-city discovery (server-side DISTINCT; paginates as fallback)
 # -------------------------
 def fetch_unique_cities(since_utc: datetime) -> list[str]:
     """Return a sorted unique list of cities with recent data (since_utc).
     
-    This is much more efficient as it filters for recent records first.
+    Uses the `cities_since` RPC (sql/cities_since.sql) so Postgres does the
+    DISTINCT; falls back to paging the city column if the function is missing.
     """
+    try:
+        resp = supabase.rpc("cities_since", {"ts": since_utc.isoformat()}).execute()
+        cities = {(r.get("city") or "").strip() for r in (resp.data or [])}
+        cities.discard("")
+    except Exception as e:
+        logging.warning("cities_since RPC unavailable (%s); paginating instead", e)
+        cities = _fetch_unique_cities_paged(since_utc)
+
+    sorted_cities = sorted(cities)
+    logging.info("Discovered %d cities with recent data: %s", len(sorted_cities), ", ".join(sorted_cities))
+    return sorted_cities
+
+def _fetch_unique_cities_paged(since_utc: datetime) -> set[str]:
+    """Collect cities by paging through recent rows (avoids the PostgREST page cap)."""
     cities: set[str] = set()
     page_size = 1000  # A reasonable page size for this query
     offset = 0
@@ -321,49 +406,106 @@ def fetch_unique_cities(since_utc: datetime) -> list[str]:
             
         offset += page_size
     
-    sorted_cities = sorted(cities)
-    logging.info("Discovered %d cities with recent data: %s", len(sorted_cities), ", ".join(sorted_cities))
-    return sorted_cities
+    return cities
 
 # -------------------------
-# Per-city processing
+# Bulk fetch of recent raw rows (one paginated query for all cities)
 # -------------------------
-def process_city(city: str, since_utc: datetime, valid_columns: set):
-    try:
-        resp = (
-            supabase.table("air_quality_data")
-            .select("*")
-            .eq("city", city)
-            .gte("datetime_utc", since_utc.isoformat())
-            .order("datetime_utc", desc=True)
-            .execute()
-        )
-    except Exception as e:
-        logging.error("Supabase fetch error for %s: %s", city, e)
-        return None
+def fetch_recent_rows(cities: list[str], since_utc: datetime) -> pd.DataFrame:
+    """Return all raw rows since `since_utc` for `cities` as a single DataFrame.
+
+    Replaces one round-trip per city with a single `in_` query, paginated the
+    same way as fetch_unique_cities, and only selects RAW_COLS. Errors
+    propagate to the caller.
+    """
+    global _raw_select
+    rows: list[dict] = []
+    page_size = 1000
+    offset = 0
+
+    while True:
+        try:
+            resp = (
+                supabase
+                .table("air_quality_data")
+                .select(_raw_select)
+                .in_("city", cities)
+                .gte("datetime_utc", since_utc.isoformat())
+                .order("datetime_utc", desc=True)
+                .order("city")  # (city, datetime_utc) is unique -> stable pages
+                .range(offset, offset + page_size - 1)
+                .execute()
+            )
+        except Exception as e:
+            if _raw_select == "*":
+                raise
+            logging.warning("Projected select failed (%s); falling back to select('*')", e)
+            _raw_select = "*"
+            continue
+        page = resp.data or []
+        rows.extend(page)
+
+        if len(page) < page_size:
+            break
+
+        offset += page_size
+
+    logging.info("Fetched %d raw rows for %d cities", len(rows), len(cities))
+    return pd.DataFrame(rows)
 
-    rows = resp.data or []
-    if not rows:
+# -------------------------
+# Per-city processing
+# -------------------------
+def process_city(city: str, df: pd.DataFrame, valid_columns: set):
+    if df is None or df.empty:
         logging.info("%s: no rows in last 24h", city)
         return None
 
-    df = pd.DataFrame(rows)
     keep = [c for c in RAW_COLS if c in df.columns]
     if not keep:
         logging.warning("%s: none of expected raw cols present", city)
         return None
     df = df[keep].copy()
+    # coerce once so the feature blocks can skip per-expression .astype(float)
+    num = [c for c in NUMERIC_COLS if c in df.columns]
+    df[num] = df[num].apply(pd.to_numeric, errors="coerce")
+
+    # load models first so feature engineering only builds what they consume
+    models = {}
+    for horizon, col_name in [("h1","aqi_1h_pred"),("h2","aqi_2h_pred"),("h3","aqi_3h_pred")]:
+        model = load_model(city, horizon)
+        if model is None:
+            logging.info("%s: model for %s not found", city, horizon)
+            continue
+        models[horizon, col_name] = model
+
+    if not models:
+        logging.warning("%s: no predictions produced", city)
+        return None
+
+    needed: set | None = set()
+    for model in models.values():
+        names = model_feature_names(model)
+        if names is None:
+            needed = None  # unknown schema -> build every feature
+            break
+        needed.update(names)
 
     # compute AQI block & features
     df = compute_aqi_block(df)
-    df = engineer_features(df)
+    df = engineer_features(df, needed)
 
     # aggregate last 6h into feature vector (numeric mean)
     numeric = df.select_dtypes(include=[np.number]).columns.tolist()
     if not numeric:
         logging.warning("%s: no numeric columns to aggregate", city)
         return None
-    X_agg = df[numeric].mean(numeric_only=True).to_frame().T
+    # NaN-skipping column means straight from one float64 block; all-NaN columns
+    # stay NaN, and nanmean's expected "Mean of empty slice" warning is silenced
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", category=RuntimeWarning)
+        means = np.nanmean(df[numeric].to_numpy(dtype=np.float64), axis=0)
+    X_agg = pd.DataFrame(means.reshape(1, -1), columns=numeric)
 
     # attach last timestamp
     latest_ts = pd.to_datetime(df["datetime_utc"].iloc[-1], utc=True)
@@ -375,15 +517,11 @@ def process_city(city: str, since_utc: datetime, valid_columns: set):
     preds: dict[str, float] = {}
     preds_cat: dict[str, str | None] = {}
 
-    # load & predict for each horizon
-    for horizon, col_name in [("h1","aqi_1h_pred"),("h2","aqi_2h_pred"),("h3","aqi_3h_pred")]:
-        model = load_model(city, horizon)
-        if model is None:
-            logging.info("%s: model for %s not found", city, horizon)
-            continue
+    # predict for each horizon
+    for (horizon, col_name), model in models.items():
         X_model = align_features_to_model(X_for_model, model)
         try:
-            yhat = model.predict(X_model)
+            yhat = model.predict(to_model_input(X_model, model))
             val = float(yhat[0]) if hasattr(yhat, "__len__") else float(yhat)
             preds[col_name] = max(0.0, val)
             preds_cat[f"{col_name}_category"] = aqi_category(val)
@@ -396,27 +534,29 @@ def process_city(city: str, since_utc: datetime, valid_columns: set):
         return None
 
     # anomaly detection on recent computed aqi series
-    recent_aqi = df["aqi"].dropna().values
+    # one float64 array shared by both detectors
+    recent_aqi = df["aqi"].dropna().to_numpy(dtype=np.float64)
     anom_flag = rolling_z_anomaly(recent_aqi, threshold=2.5, min_points=8)
     if anom_flag is None:
-        iso_flag = isolation_anomaly(recent_aqi, contamination=0.05)
-        anom_flag = bool(iso_flag) if iso_flag is not None else None
+        anom_flag = mad_anomaly(recent_aqi, k=3.5, min_points=8)
+
+    # read the latest row once instead of indexing each column Series
+    last = df.iloc[-1].to_dict()
 
-    latest_actual = df["aqi"].iloc[-1] if not df["aqi"].isna().all() else None
+    def g(k):
+        v = last.get(k)
+        return None if v is None or (isinstance(v, float) and math.isnan(v)) else float(v)
+
+    latest_actual = g("aqi")
     latest_cat = aqi_category(latest_actual) if latest_actual is not None else None
-    latest_dom = df["dominant_pollutant"].iloc[-1] if "dominant_pollutant" in df.columns else None
+    latest_dom = last.get("dominant_pollutant")
 
     out = {
         "city": city,
         "datetime_utc": latest_ts.isoformat(),
         "datetime_ist": latest_ts.tz_convert("Asia/Kolkata").isoformat(),
-        "pm10_index": float(df["pm10_index"].iloc[-1]) if pd.notna(df["pm10_index"].iloc[-1]) else None,
-        "pm2_5_index": float(df["pm2_5_index"].iloc[-1]) if pd.notna(df["pm2_5_index"].iloc[-1]) else None,
-        "nitrogen_dioxide_index": float(df["nitrogen_dioxide_index"].iloc[-1]) if "nitrogen_dioxide_index" in df.columns and pd.notna(df["nitrogen_dioxide_index"].iloc[-1]) else None,
-        "sulphur_dioxide_index": float(df["sulphur_dioxide_index"].iloc[-1]) if "sulphur_dioxide_index" in df.columns and pd.notna(df["sulphur_dioxide_index"].iloc[-1]) else None,
-        "carbon_monoxide_index": float(df["carbon_monoxide_index"].iloc[-1]) if "carbon_monoxide_index" in df.columns and pd.notna(df["carbon_monoxide_index"].iloc[-1]) else None,
-        "ozone_index": float(df["ozone_index"].iloc[-1]) if "ozone_index" in df.columns and pd.notna(df["ozone_index"].iloc[-1]) else None,
-        "aqi": float(latest_actual) if latest_actual is not None else None,
+        **{c: g(c) for c in INDEX_COLS},
+        "aqi": latest_actual,
         "aqi_category": latest_cat,
         "dominant_pollutant": latest_dom,
         "anomaly": int(anom_flag) if anom_flag is not None else None,
@@ -424,15 +564,11 @@ def process_city(city: str, since_utc: datetime, valid_columns: set):
     }
 
     # attach predictions and categories
-    for k, v in preds.items():
-        out[k] = v
-    for k, v in preds_cat.items():
-        out[k] = v
+    out.update(preds)
+    out.update(preds_cat)
 
     # attach last raw pollutant values (optional contextual columns)
-    for col in ["pm2_5","pm10","nitrogen_dioxide","sulphur_dioxide","carbon_monoxide","ozone"]:
-        if col in df.columns:
-            out[f"latest_{col}"] = float(df[col].iloc[-1]) if pd.notna(df[col].iloc[-1]) else None
+    out.update({f"latest_{c}": g(c) for c in LATEST_COLS if c in last})
 
     # filter to only valid columns
     out_filtered = {k: v for k, v in out.items() if k in valid_columns}
@@ -444,6 +580,7 @@ def process_city(city: str, since_utc: datetime, valid_columns: set):
 # -------------------------
 def run_pipeline():
     logging.info("Starting AQI pipeline")
+    _load_model_file.cache_clear()  # pick up retrained models on every run
 
     valid_columns = get_table_columns("aqi_results")
     logging.info("aqi_results columns (sample): %s", sorted(list(valid_columns))[:20])
@@ -462,11 +599,19 @@ def run_pipeline():
         logging.warning("No cities with recent data found to process.")
         return
 
+    try:
+        recent = fetch_recent_rows(cities, since_utc)
+    except Exception as e:
+        logging.error("Supabase fetch error for recent rows: %s", e)
+        return
+
+    by_city = dict(tuple(recent.groupby("city", sort=False))) if "city" in recent.columns else {}
+
     rows_to_write = []
     for city in cities:
         logging.info("Processing city: %s", city)
         try:
-            out = process_city(city, since_utc, valid_columns)
+            out = process_city(city, by_city.get(city), valid_columns)
             if out:
                 rows_to_write.append(out)
         except Exception as e:
@@ -476,18 +621,23 @@ def run_pipeline():
         logging.info("No rows to write.")
         return
 
-    # write to supabase (one-by-one upsert with insert fallback)
-    for row in rows_to_write:
-        try:
-            supabase.table("aqi_results").upsert(row).execute()
-            logging.info("Upserted: %s @ %s", row.get("city"), row.get("datetime_utc"))
-        except Exception as e:
-            logging.warning("Upsert failed for %s: %s. Trying insert.", row.get("city"), e)
+    # write to supabase: one bulk upsert, falling back to per-row upsert/insert
+    try:
+        supabase.table("aqi_results").upsert(rows_to_write, on_conflict="city,datetime_utc").execute()
+        logging.info("Upserted %d rows: %s", len(rows_to_write), ", ".join(str(r.get("city")) for r in rows_to_write))
+    except Exception as e:
+        logging.warning("Bulk upsert failed (%s), falling back to per-row", e)
+        for row in rows_to_write:
             try:
-                supabase.table("aqi_results").insert(row).execute()
-                logging.info("Inserted: %s @ %s", row.get("city"), row.get("datetime_utc"))
-            except Exception as e2:
-                logging.error("Insert failed for %s: %s", row.get("city"), e2)
+                supabase.table("aqi_results").upsert(row).execute()
+                logging.info("Upserted: %s @ %s", row.get("city"), row.get("datetime_utc"))
+            except Exception as e1:
+                logging.warning("Upsert failed for %s: %s. Trying insert.", row.get("city"), e1)
+                try:
+                    supabase.table("aqi_results").insert(row).execute()
+                    logging.info("Inserted: %s @ %s", row.get("city"), row.get("datetime_utc"))
+                except Exception as e2:
+                    logging.error("Insert failed for %s: %s", row.get("city"), e2)
 
     logging.info("Pipeline complete.")
 
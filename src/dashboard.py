@@ -1,16 +1,20 @@
 # dashboard.py
 import os
-from io import BytesIO
-from datetime import datetime, timezone
+import time
+import functools
+import uuid
+import hashlib
+from io import BytesIO, StringIO
 
 import numpy as np
 import pandas as pd
 import plotly.graph_objects as go
+import pydeck as pdk
 import streamlit as st
+from PIL import Image
 from dotenv import load_dotenv
 from streamlit_autorefresh import st_autorefresh
 from supabase import create_client
-import humanize
 
 # -------------------------
 # Config / init
@@ -25,7 +29,18 @@ if not SUPABASE_URL or not SUPABASE_KEY:
     st.error("Missing Supabase credentials. Set SUPABASE_URL and SUPABASE_KEY (or SUPABASE_SERVICE_KEY).")
     st.stop()
 
-supabase = create_client(SUPABASE_URL, SUPABASE_KEY)
+@st.cache_resource
+def get_supabase():
+    """One Supabase client per server process, shared across reruns and sessions."""
+    return create_client(SUPABASE_URL, SUPABASE_KEY)
+
+supabase = get_supabase()
+
+# Non-pollutant columns hidden from the Pollutants picker
+EXCLUDE_COLS = frozenset({"city", "datetime_utc", "dt_disp", "aqi", "anomaly", "id"})
+
+# On-disk query cache (see cached_query)
+CACHE_DIR = os.getenv("AQI_CACHE_DIR", ".aqi_cache")
 
 # City coordinates (for map)
 CITY_COORDS = {
@@ -33,77 +48,176 @@ CITY_COORDS = {
     "Mumbai": (19.0760, 72.8777),
     "Hyderabad": (17.3850, 78.4867),
 }
+CITIES = tuple(CITY_COORDS)
+CITY_IDX = {c: i for i, c in enumerate(CITIES)}
 
 # -----------------
 # Helpers
 # -----------------
+# AQI bands (upper bounds) with their labels, card colors and advisories
+_AQI_BINS = np.array([50, 100, 200, 300, 400, 500])
+_AQI_CATS = np.array(["Good", "Satisfactory", "Moderate", "Poor", "Very Poor", "Severe"])
+_AQI_COLORS = np.array([
+    "rgba(34,197,94,1)", "rgba(132,204,22,1)", "rgba(250,204,21,1)",
+    "rgba(249,115,22,1)", "rgba(239,68,68,1)", "rgba(139,92,246,1)",
+])
+# Same palette as RGB triples for pydeck layers
+_AQI_RGB = np.array([
+    [34, 197, 94], [132, 204, 22], [250, 204, 21],
+    [249, 115, 22], [239, 68, 68], [139, 92, 246],
+])
+_AQI_MSGS = np.array([
+    "Air quality is considered safe.",
+    "Minor breathing discomfort possible.",
+    "Sensitive groups should limit prolonged exertion.",
+    "Breathing discomfort for most people.",
+    "Avoid outdoor activity; use masks if outside.",
+    "Serious health impacts; stay indoors.",
+])
+
+def categorize_aqi(aqi_vals) -> np.ndarray:
+    """
+    Vectorized AQI -> band index (0=Good … 5=Severe) for a whole array.
+    Values are rounded first; None/NaN count as 0 (same as get_aqi_category).
+    """
+    a = np.rint(np.nan_to_num(np.asarray(aqi_vals, dtype=float), nan=0.0))
+    return np.searchsorted(_AQI_BINS, np.clip(a, 0, 500), side="left")
+
 def get_aqi_category(aqi_val) -> tuple[str, str, str]:
     """
     Return (category, rgba_color, advisory_message) for an AQI value.
     Accepts None/NaN safely.
     """
     try:
-        aqi = 0 if aqi_val is None or (isinstance(aqi_val, float) and np.isnan(aqi_val)) else int(round(float(aqi_val)))
+        i = int(categorize_aqi([aqi_val])[0])
     except Exception:
-        aqi = 0
-
-    if aqi <= 50:
-        return "Good", "rgba(34,197,94,1)", "Air quality is considered safe."
-    elif aqi <= 100:
-        return "Satisfactory", "rgba(132,204,22,1)", "Minor breathing discomfort possible."
-    elif aqi <= 200:
-        return "Moderate", "rgba(250,204,21,1)", "Sensitive groups should limit prolonged exertion."
-    elif aqi <= 300:
-        return "Poor", "rgba(249,115,22,1)", "Breathing discomfort for most people."
-    elif aqi <= 400:
-        return "Very Poor", "rgba(239,68,68,1)", "Avoid outdoor activity; use masks if outside."
-    else:
-        return "Severe", "rgba(139,92,246,1)", "Serious health impacts; stay indoors."
-
-def add_aqi_band_shapes(fig: go.Figure, x_min, x_max):
-    """Add shaded AQI bands (uses proper rgba colors)."""
-    if pd.isna(x_min) or pd.isna(x_max):
-        return
-    aqi_bands = [
-        (0,   50,  "rgba(34,197,94,0.15)"),
-        (51,  100, "rgba(132,204,22,0.15)"),
-        (101, 200, "rgba(250,204,21,0.15)"),
-        (201, 300, "rgba(249,115,22,0.15)"),
-        (301, 400, "rgba(239,68,68,0.15)"),
-        (401, 500, "rgba(139,92,246,0.15)"),
-    ]
-    for low, high, color in aqi_bands:
-        fig.add_shape(
-            type="rect",
-            x0=x_min, x1=x_max,
-            y0=low, y1=high,
-            fillcolor=color,
-            line_width=0,
-            layer="below",
-        )
+        i = 0
+    return str(_AQI_CATS[i]), str(_AQI_COLORS[i]), str(_AQI_MSGS[i])
+
+def _render_band_image():
+    """500x1 px strip, one row per AQI unit (top row = 500), in the category colors."""
+    rows = _AQI_RGB[categorize_aqi(np.arange(499, -1, -1))].astype(np.uint8)
+    return Image.fromarray(rows.reshape(500, 1, 3))
+
+_AQI_BG = _render_band_image()
+
+def add_aqi_bands(fig: go.Figure):
+    """Shade the AQI category bands with one stretched background image
+    (a single DOM node, independent of the x-range) instead of six rects."""
+    fig.add_layout_image(
+        source=_AQI_BG,
+        xref="x domain", yref="y",
+        x=0, y=500, sizex=1, sizey=500,
+        sizing="stretch", layer="below", opacity=0.15,
+    )
     fig.update_yaxes(range=[0, 500])
 
-def fmt_aqi(v) -> str:
-    """Format AQI safely; returns '—' if invalid."""
-    try:
-        if v is None or (isinstance(v, float) and np.isnan(v)):
-            return "—"
-        return f"{int(round(float(v)))}"
-    except Exception:
-        return "—"
+def session_figure(key: str, traces: list[dict], **layout) -> go.Figure:
+    """
+    Keep a tab's figure in st.session_state across reruns. When the trace set
+    (names/modes) is unchanged, only x/y arrays are swapped; otherwise the
+    figure is rebuilt.
+    """
+    sig = tuple((t["name"], t["mode"]) for t in traces)
+    cached = st.session_state.get(key)
+    if cached is not None and cached["sig"] == sig:
+        fig = cached["fig"]
+        with fig.batch_update():
+            for tr, t in zip(fig.data, traces):
+                tr.x, tr.y = t["x"], t["y"]
+        return fig
+
+    fig = go.Figure([go.Scatter(**t) for t in traces])
+    add_aqi_bands(fig)
+    fig.update_layout(**layout)
+    st.session_state[key] = {"sig": sig, "fig": fig}
+    return fig
+
+def _humanize_seconds(sec: float) -> str:
+    """'x minutes ago' style text for an age in seconds (same buckets as humanize.naturaltime)."""
+    if sec < 1:
+        return "now"
+    if sec < 60:
+        return "a second ago" if sec < 2 else f"{int(sec)} seconds ago"
+    if sec < 120:
+        return "a minute ago"
+    if sec < 3600:
+        return f"{int(sec // 60)} minutes ago"
+    if sec < 7200:
+        return "an hour ago"
+    if sec < 86400:
+        return f"{int(sec // 3600)} hours ago"
+    if sec < 172800:
+        return "a day ago"
+    return f"{int(sec // 86400)} days ago"
+
+def _round_aqi(s: pd.Series):
+    """Round AQI values to nullable integers in one vectorized pass (NaN -> <NA>)."""
+    return pd.array(np.rint(s.to_numpy(dtype=float)), dtype="Int64")
+
+def _typed(s: pd.Series) -> np.ndarray:
+    """float32 array for Plotly traces; plotly>=6 ships it as a base64 typed array (NaN -> gap)."""
+    return s.to_numpy(dtype=np.float32, na_value=np.nan)
+
+def _plot_aqi(s: pd.Series) -> np.ndarray:
+    """Rounded AQI as a contiguous float32 array for plotting."""
+    return np.rint(_typed(s))
+
+def _plot_time(s: pd.Series) -> np.ndarray:
+    """Naive datetimes as float64 epoch-ms: shipped as a typed array instead of
+    ISO strings (pair with `xaxis type="date"`)."""
+    return s.to_numpy().astype("datetime64[ms]").astype(np.int64).astype(np.float64)
+
+PLOT_MAX_POINTS = 500     # points per trace after downsampling
+PLOT_DOWNSAMPLE_MIN = 1000  # only downsample frames longer than this
+
+def lttb_indices(x: np.ndarray, y: np.ndarray, n_out: int) -> np.ndarray:
+    """Largest-Triangle-Three-Buckets: indices of `n_out` points that keep the
+    visual shape of (x, y). First and last points are always kept."""
+    n = len(y)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+    edges = np.linspace(1, n - 1, n_out - 1).astype(np.int64)  # n_out-2 interior buckets
+    out = np.empty(n_out, dtype=np.int64)
+    out[0], out[-1] = 0, n - 1
+    a = 0
+    for i in range(n_out - 2):
+        lo, hi = edges[i], edges[i + 1]
+        if i + 2 < len(edges):
+            nxt = y[hi:edges[i + 2]]
+            nxt = nxt[~np.isnan(nxt)]  # NaN-skipping mean; one NaN must not poison every area
+            nx, ny = x[hi:edges[i + 2]].mean(), (nxt.mean() if nxt.size else y[a])
+        else:
+            nx, ny = x[n - 1], y[n - 1]
+        area = np.abs((x[a] - nx) * (y[lo:hi] - y[a]) - (x[a] - x[lo:hi]) * (ny - y[a]))
+        a = lo + int(np.argmax(np.where(np.isnan(area), -1.0, area)))
+        out[i + 1] = a
+    return out
+
+def downsample_for_plot(df: pd.DataFrame, y: str = "aqi") -> pd.DataFrame:
+    """LTTB-thin a frame for plotting only (exports keep every row)."""
+    if len(df) <= PLOT_DOWNSAMPLE_MIN or y not in df.columns:
+        return df
+    x_vals = df["dt_disp"].astype("int64").to_numpy(dtype=np.float64)
+    y_vals = df[y].to_numpy(dtype=np.float64, na_value=np.nan)
+    return df.iloc[lttb_indices(x_vals, y_vals, PLOT_MAX_POINTS)]
+
+def to_csv_bytes(df: pd.DataFrame) -> bytes:
+    """UTF-8 CSV export helper."""
+    return df.to_csv(index=False).encode("utf-8")
 
 def to_excel_bytes(df: pd.DataFrame) -> bytes:
     """
     Excel export helper:
     - Converts tz-aware datetimes to tz-naive (Excel doesn't support tz).
-    - Uses openpyxl (add `openpyxl` to requirements).
+    - Uses xlsxwriter (add `XlsxWriter` to requirements); ~2x faster than openpyxl.
     """
     df_copy = df.copy()
     # Normalize timezone-aware datetimes → naive
     for col in df_copy.select_dtypes(include=["datetimetz"]).columns:
         df_copy[col] = df_copy[col].dt.tz_convert(None)
     buf = BytesIO()
-    with pd.ExcelWriter(buf, engine="openpyxl") as writer:
+    with pd.ExcelWriter(buf, engine="xlsxwriter", engine_kwargs={"options": {"strings_to_formulas": False}}) as writer:
         df_copy.to_excel(writer, index=False)
     return buf.getvalue()
 
@@ -112,71 +226,127 @@ def download_button(df: pd.DataFrame, label: str, file_name: str, *, kind: str =
     if df is None or df.empty:
         st.button(label, disabled=True, key=f"disabled_{key}")
         return
+    # Deferred: Streamlit only calls `data` when the button is clicked
     if kind == "csv":
-        data = df.to_csv(index=False).encode("utf-8")
+        data = functools.partial(to_csv_bytes, df)
         mime = "text/csv"
     else:
-        data = to_excel_bytes(df)
+        data = functools.partial(to_excel_bytes, df)
         mime = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
     st.download_button(label=label, data=data, file_name=file_name, mime=mime, key=key)
 
-@st.cache_data(ttl=60, show_spinner=False)
+def _query_frame(query) -> pd.DataFrame:
+    """
+    Run a PostgREST select/RPC as CSV (Accept: text/csv) and parse it with
+    pandas' C reader, skipping the JSON -> list[dict] -> DataFrame path.
+    Falls back to JSON if the client has no .csv().
+    """
+    try:
+        raw = query.csv().execute().data or ""
+    except AttributeError:
+        return pd.DataFrame(query.execute().data or [])
+    return pd.read_csv(StringIO(raw)) if raw.strip() else pd.DataFrame()
+
+def cached_query(key: str, ttl: int, fn) -> pd.DataFrame:
+    """
+    Disk-backed (parquet) cache in front of a Supabase query, so a warm cache
+    survives process restarts/evictions that clear st.cache_data.
+    Entries older than `ttl` seconds are refetched; cache I/O errors only
+    cost a refetch.
+    """
+    path = os.path.join(CACHE_DIR, hashlib.sha1(key.encode("utf-8")).hexdigest() + ".parquet")
+    try:
+        if time.time() - os.path.getmtime(path) < ttl:
+            return pd.read_parquet(path)
+    except Exception:
+        pass
+
+    df = fn()
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        tmp = f"{path}.{uuid.uuid4().hex}.tmp"  # concurrent sessions: write then atomic rename
+        df.to_parquet(tmp, index=False)
+        os.replace(tmp, path)
+    except Exception:
+        pass
+    return df
+
+@st.cache_data(ttl=60, show_spinner=False, max_entries=8)
 def load_city_data(city: str, limit: int = 2000) -> pd.DataFrame:
     """Load recent rows for a single city from aqi_results."""
-    res = (
+    return cached_query(f"city_data|{city}|{limit}", 60, lambda: _fetch_city_data(city, limit))
+
+def _fetch_city_data(city: str, limit: int) -> pd.DataFrame:
+    df = _query_frame(
         supabase.table("aqi_results")
         .select("*")
         .eq("city", city)
         .order("datetime_utc", desc=True)
         .limit(limit)
-        .execute()
     )
-    df = pd.DataFrame(res.data or [])
     if df.empty:
         return df
 
     # Parse/normalize columns
     df["datetime_utc"] = pd.to_datetime(df["datetime_utc"], utc=True, errors="coerce")
     df = df.dropna(subset=["datetime_utc"])
-    # Display tz (IST)
-    df["dt_disp"] = df["datetime_utc"].dt.tz_convert("Asia/Kolkata")
+    # Display tz (IST) as naive wall-clock time, converted once per load
+    df["dt_disp"] = df["datetime_utc"].dt.tz_convert("Asia/Kolkata").dt.tz_localize(None)
 
     if "aqi" in df.columns:
+        # Kept unrounded (exports carry the raw value); charts round via _plot_aqi
         df["aqi"] = pd.to_numeric(df["aqi"], errors="coerce")
 
     if "anomaly" in df.columns:
-        df["anomaly"] = pd.to_numeric(df["anomaly"], errors="coerce").fillna(0).astype(int)
+        df["anomaly"] = pd.to_numeric(df["anomaly"], errors="coerce").fillna(0).astype(np.int8)
 
     # Predictions (optional)
     for col in ["aqi_1h_pred", "aqi_2h_pred", "aqi_3h_pred"]:
         if col in df.columns:
             df[col] = pd.to_numeric(df[col], errors="coerce")
 
+    # Downcast pollutants/predictions: halves cache footprint and plot payloads
+    for col in df.select_dtypes("float64").columns:
+        df[col] = df[col].astype(np.float32)
+
     return df
 
 @st.cache_data(ttl=60, show_spinner=False)
-def load_latest_rows(cities: list[str]) -> pd.DataFrame:
-    """Get a single latest row per city."""
-    latest = []
-    for c in cities:
-        resp = (
+def load_latest_rows(cities: tuple[str, ...]) -> pd.DataFrame:
+    """Get a single latest row per city (one RPC, see sql/latest_aqi_per_city.sql)."""
+    return cached_query(f"latest_rows|{','.join(cities)}", 60, lambda: _fetch_latest_rows(cities))
+
+def _fetch_latest_rows(cities: tuple[str, ...]) -> pd.DataFrame:
+    try:
+        return _parse_latest(_query_frame(supabase.rpc("latest_aqi_per_city", {"cities": list(cities)})))
+    except Exception:
+        pass  # function not deployed yet: fall back to one query per city
+
+    latest = [
+        _query_frame(
             supabase.table("aqi_results")
             .select("*")
             .eq("city", c)
             .order("datetime_utc", desc=True)
             .limit(1)
-            .execute()
         )
-        if resp.data:
-            latest.append(resp.data[0])
-    return pd.DataFrame(latest)
+        for c in cities
+    ]
+    latest = [f for f in latest if not f.empty]
+    return _parse_latest(pd.concat(latest, ignore_index=True) if latest else pd.DataFrame())
+
+def _parse_latest(df: pd.DataFrame) -> pd.DataFrame:
+    """Parse datetime_utc once at load time so the KPI cards don't re-parse it."""
+    if "datetime_utc" in df.columns:
+        df["datetime_utc"] = pd.to_datetime(df["datetime_utc"], utc=True, errors="coerce")
+    return df
 
 # -----------------
 # Sidebar
 # -----------------
 st.sidebar.title("Controls")
 
-sidebar_city = st.sidebar.selectbox("Default City", list(CITY_COORDS.keys()), index=0)
+sidebar_city = st.sidebar.selectbox("Default City", CITIES, index=0)
 auto_refresh = st.sidebar.checkbox("Auto-refresh", True)
 refresh_mins = st.sidebar.slider("Refresh interval (minutes)", 1, 30, 5)
 anomaly_only = st.sidebar.checkbox("Show anomalies only", False)
@@ -184,6 +354,23 @@ anomaly_only = st.sidebar.checkbox("Show anomalies only", False)
 if auto_refresh:
     st_autorefresh(interval=refresh_mins * 60 * 1000, key="autorefresh")
 
+# One full fetch for the sidebar city; tabs showing that city reuse it
+# instead of issuing their own queries.
+df_current_city = load_city_data(sidebar_city, limit=2000)
+
+def city_frame(city: str) -> pd.DataFrame:
+    """Rows for `city`, reusing df_current_city when it is the sidebar city."""
+    if city != sidebar_city:
+        return load_city_data(city, limit=2000)
+    return df_current_city
+
+def anomaly_rows(df: pd.DataFrame) -> pd.DataFrame:
+    """Anomalous rows of an already-loaded city frame (chart and exports
+    filter the same rows); unchanged if the frame has no anomaly column."""
+    if "anomaly" not in df.columns:
+        return df
+    return df[df["anomaly"] == 1]
+
 # -----------------
 # Layout / Tabs
 # -----------------
@@ -199,14 +386,18 @@ tab_overview, tab_forecast, tab_trends, tab_pollutants, tab_map = st.tabs(
 # -----------------
 with tab_overview:
     st.subheader("Latest AQI Snapshot (All Cities)")
-    cols = st.columns(len(CITY_COORDS))
+    cols = st.columns(len(CITIES))
 
-    latest_df = load_latest_rows(list(CITY_COORDS.keys()))
+    latest_df = load_latest_rows(CITIES)
     if latest_df.empty:
         st.info("No data available yet.")
     else:
+        # Parse timestamps and ages once for all cards
+        latest_ts = latest_df["datetime_utc"]
+        latest_age = (pd.Timestamp.now(tz="UTC") - latest_ts).dt.total_seconds()
+
         # Render KPI cards
-        for i, c in enumerate(CITY_COORDS.keys()):
+        for i, c in enumerate(CITIES):
             row = latest_df[latest_df.get("city") == c]
             with cols[i]:
                 if row.empty:
@@ -218,10 +409,8 @@ with tab_overview:
                     aqi_display = "—" if aqi_round is None else str(aqi_round)
                     cat, color, msg = get_aqi_category(aqi_round)
 
-                    ts = pd.to_datetime(r["datetime_utc"], utc=True, errors="coerce")
-                    updated = "—"
-                    if pd.notna(ts):
-                        updated = humanize.naturaltime(datetime.now(timezone.utc) - ts)
+                    age = latest_age.loc[row.index[0]]
+                    updated = "—" if pd.isna(age) else _humanize_seconds(age)
 
                     st.markdown(
                         f"""
@@ -252,7 +441,7 @@ with tab_overview:
 
         # Last retrieved timestamp
         if "datetime_utc" in latest_df.columns and not latest_df["datetime_utc"].isna().all():
-            last_retrieved = pd.to_datetime(latest_df["datetime_utc"], utc=True, errors="coerce").max()
+            last_retrieved = latest_ts.max()
             if pd.notna(last_retrieved):
                 st.info(f"🕒 Last data retrieved at: {last_retrieved.strftime('%Y-%m-%d %H:%M UTC')}")
 
@@ -260,9 +449,7 @@ with tab_overview:
         st.markdown("### Export Latest Snapshot Table")
         export_latest = latest_df.copy()
         if "aqi" in export_latest.columns:
-            export_latest["aqi"] = pd.to_numeric(
-                export_latest["aqi"], errors="coerce"
-            ).round().astype("Int64")
+            export_latest["aqi"] = _round_aqi(pd.to_numeric(export_latest["aqi"], errors="coerce"))
         download_button(
             export_latest, "⬇️ Latest Snapshot (CSV)", "overview_latest_snapshot.csv",
             kind="csv", key="overview_latest_csv",
@@ -278,33 +465,25 @@ with tab_overview:
 with tab_forecast:
     tab_city = st.selectbox(
         "City for Forecast view",
-        list(CITY_COORDS.keys()),
-        index=list(CITY_COORDS.keys()).index(sidebar_city),
+        CITIES,
+        index=CITY_IDX[sidebar_city],
         key="forecast_city_select",
     )
-    df_city = load_city_data(tab_city, limit=2000)
+    df_city = city_frame(tab_city)
 
     st.subheader(f"Forecast – {tab_city}")
     if df_city.empty:
         st.info("No data available.")
     else:
-        df_plot = df_city.copy()
-        if anomaly_only and "anomaly" in df_plot.columns:
-            df_plot = df_plot[df_plot["anomaly"] == 1]
+        df_plot = anomaly_rows(df_city) if anomaly_only else df_city
 
         if df_plot.empty:
             st.info("No rows match the current filter (anomalies only).")
         else:
-            fig = go.Figure()
+            df_fig = downsample_for_plot(df_plot)
+            x = _plot_time(df_fig["dt_disp"])
             # Actual AQI
-            fig.add_trace(
-                go.Scatter(
-                    x=df_plot["dt_disp"],
-                    y=df_plot["aqi"].apply(lambda v: int(round(v)) if pd.notna(v) else None),
-                    mode="lines+markers",
-                    name="AQI",
-                )
-            )
+            traces = [dict(x=x, y=_plot_aqi(df_fig["aqi"]), mode="lines+markers", name="AQI")]
             # Optional predictions if present
             pred_names = {
                 "aqi_1h_pred": "+1h (pred)",
@@ -313,20 +492,13 @@ with tab_forecast:
             }
             for col, name in pred_names.items():
                 if col in df_plot.columns:
-                    fig.add_trace(
-                        go.Scatter(
-                            x=df_plot["dt_disp"],
-                            y=df_plot[col],
-                            mode="lines",
-                            name=name,
-                            line=dict(dash="dot"),
-                        )
-                    )
+                    traces.append(dict(x=x, y=_typed(df_fig[col]), mode="lines", name=name, line=dict(dash="dot")))
 
-            add_aqi_band_shapes(fig, df_plot["dt_disp"].min(), df_plot["dt_disp"].max())
-            fig.update_layout(
+            fig = session_figure(
+                "fig_forecast", traces,
                 yaxis_title="AQI",
                 xaxis_title="Time",
+                xaxis_type="date",
                 template="plotly_dark",
                 hovermode="x unified",
                 legend=dict(orientation="h", yanchor="bottom", y=1.02, xanchor="right", x=1),
@@ -352,7 +524,7 @@ with tab_forecast:
             kind="excel", key="forecast_all_xlsx",
         )
         if "anomaly" in df_city.columns:
-            anomalies = df_city[df_city["anomaly"] == 1]
+            anomalies = anomaly_rows(df_city)
             if not anomalies.empty:
                 download_button(
                     anomalies, "⬇️ Anomalies Only (CSV)", f"{tab_city}_forecast_anomalies.csv",
@@ -373,51 +545,41 @@ with tab_forecast:
 with tab_trends:
     tab_city_tr = st.selectbox(
         "City for Trends view",
-        list(CITY_COORDS.keys()),
-        index=list(CITY_COORDS.keys()).index(sidebar_city),
+        CITIES,
+        index=CITY_IDX[sidebar_city],
         key="trends_city_select",
     )
-    df_city_tr = load_city_data(tab_city_tr, limit=2000)
+    df_city_tr = city_frame(tab_city_tr)
 
     st.subheader(f"Trends – {tab_city_tr}")
     if df_city_tr.empty:
         st.info("No data available.")
     else:
-        df_plot_tr = df_city_tr.copy()
-        if anomaly_only and "anomaly" in df_plot_tr.columns:
-            df_plot_tr = df_plot_tr[df_plot_tr["anomaly"] == 1]
+        df_plot_tr = anomaly_rows(df_city_tr) if anomaly_only else df_city_tr
 
         if df_plot_tr.empty:
             st.info("No rows match the current filter (anomalies only).")
         else:
-            fig = go.Figure()
+            df_fig = downsample_for_plot(df_plot_tr)
             # AQI line
-            fig.add_trace(
-                go.Scatter(
-                    x=df_plot_tr["dt_disp"],
-                    y=df_plot_tr["aqi"].apply(lambda v: int(round(v)) if pd.notna(v) else None),
-                    mode="lines",
-                    name="AQI",
-                )
-            )
+            traces = [dict(x=_plot_time(df_fig["dt_disp"]), y=_plot_aqi(df_fig["aqi"]), mode="lines", name="AQI")]
             # Highlight anomaly points if not filtering to anomalies
             if "anomaly" in df_plot_tr.columns and not anomaly_only:
                 ann = df_plot_tr[df_plot_tr["anomaly"] == 1]
                 if not ann.empty:
-                    fig.add_trace(
-                        go.Scatter(
-                            x=ann["dt_disp"],
-                            y=ann["aqi"].apply(lambda v: int(round(v)) if pd.notna(v) else None),
-                            mode="markers",
-                            marker=dict(color="red", size=10, symbol="x"),
-                            name="Anomaly",
-                        )
-                    )
-
-            add_aqi_band_shapes(fig, df_plot_tr["dt_disp"].min(), df_plot_tr["dt_disp"].max())
-            fig.update_layout(
+                    traces.append(dict(
+                        x=_plot_time(ann["dt_disp"]),
+                        y=_plot_aqi(ann["aqi"]),
+                        mode="markers",
+                        marker=dict(color="red", size=10, symbol="x"),
+                        name="Anomaly",
+                    ))
+
+            fig = session_figure(
+                "fig_trends", traces,
                 yaxis_title="AQI",
                 xaxis_title="Time",
+                xaxis_type="date",
                 template="plotly_dark",
                 hovermode="x unified",
             )
@@ -442,7 +604,7 @@ with tab_trends:
             kind="excel", key="trends_all_xlsx",
         )
         if "anomaly" in df_city_tr.columns:
-            anomalies_tr = df_city_tr[df_city_tr["anomaly"] == 1]
+            anomalies_tr = anomaly_rows(df_city_tr)
             if not anomalies_tr.empty:
                 st.markdown("#### Detected Anomalies")
                 st.dataframe(anomalies_tr, use_container_width=True)
@@ -461,18 +623,19 @@ with tab_trends:
 with tab_pollutants:
     tab_city_pol = st.selectbox(
         "City for Pollutants view",
-        list(CITY_COORDS.keys()),
-        index=list(CITY_COORDS.keys()).index(sidebar_city),
+        CITIES,
+        index=CITY_IDX[sidebar_city],
         key="pollutants_city_select",
     )
-    df_city_pol = load_city_data(tab_city_pol, limit=2000)
+    df_city_pol = city_frame(tab_city_pol)
 
     st.subheader(f"Pollutant Breakdown – {tab_city_pol}")
     if df_city_pol.empty:
         st.info("No data available.")
     else:
-        exclude_cols = {"city", "datetime_utc", "dt_disp", "aqi", "anomaly", "id"}
-        pollutant_cols = [c for c in df_city_pol.columns if c not in exclude_cols and str(df_city_pol[c].dtype) != "object"]
+        pollutant_cols = [
+            c for c, t in df_city_pol.dtypes.items() if c not in EXCLUDE_COLS and t.kind in "fiu"
+        ]
 
         if not pollutant_cols:
             st.info("No pollutant columns available in this dataset.")
@@ -481,10 +644,11 @@ with tab_pollutants:
             if selected:
                 fig = go.Figure()
                 for pcol in selected:
-                    fig.add_trace(go.Scatter(x=df_city_pol["dt_disp"], y=df_city_pol[pcol], mode="lines", name=pcol))
+                    fig.add_trace(go.Scatter(x=_plot_time(df_city_pol["dt_disp"]), y=_typed(df_city_pol[pcol]), mode="lines", name=pcol))
                 fig.update_layout(
                     yaxis_title="Concentration",
                     xaxis_title="Time",
+                    xaxis_type="date",
                     template="plotly_dark",
                     hovermode="x unified",
                 )
@@ -495,41 +659,46 @@ with tab_pollutants:
 # -----------------
 with tab_map:
     st.subheader("City AQI Map (Last Snapshot)")
-    latest = load_latest_rows(list(CITY_COORDS.keys()))
+    latest = load_latest_rows(CITIES)
     if latest.empty:
         st.info("No latest snapshot available.")
     else:
         df_latest = latest.copy()
         # AQI + coordinates
-        df_latest["aqi"] = pd.to_numeric(df_latest["aqi"], errors="coerce").round().astype("Int64")
-        df_latest["lat"] = df_latest["city"].map(lambda x: CITY_COORDS.get(x, (None, None))[0])
-        df_latest["lon"] = df_latest["city"].map(lambda x: CITY_COORDS.get(x, (None, None))[1])
-
-        # Marker size bounded for readability
-        msize = df_latest["aqi"].astype(float).fillna(0) / 10.0
-        msize = msize.clip(lower=8, upper=22)
-
-        fig = go.Figure()
-        fig.add_trace(
-            go.Scattergeo(
-                lon=df_latest["lon"],
-                lat=df_latest["lat"],
-                text=df_latest.apply(lambda r: f"{r['city']}<br>AQI: {fmt_aqi(r['aqi'])}", axis=1),
-                mode="markers+text",
-                marker=dict(
-                    size=msize,
-                    color=df_latest["aqi"].astype(float),
-                    colorscale="Viridis",
-                    showscale=True,
-                    colorbar=dict(title="AQI"),
-                ),
-                textposition="bottom center",
-                name="Cities",
-            )
+        df_latest["aqi"] = _round_aqi(pd.to_numeric(df_latest["aqi"], errors="coerce"))
+        coords = df_latest["city"].map(CITY_COORDS)
+        df_latest["lat"] = coords.str[0]
+        df_latest["lon"] = coords.str[1]
+
+        # Plain (JSON-serializable) columns for the WebGL layer; text built vectorized
+        aqi = df_latest["aqi"].astype(float)
+        df_map = pd.DataFrame({
+            "lon": df_latest["lon"].astype(float),
+            "lat": df_latest["lat"].astype(float),
+            "radius": aqi.fillna(0).to_numpy() * 500.0,
+            "color": _AQI_RGB[categorize_aqi(aqi)].tolist(),
+            "tooltip": df_latest["city"] + "<br>AQI: " + df_latest["aqi"].astype("string").fillna("—"),
+        }).dropna(subset=["lon", "lat"])
+
+        layer = pdk.Layer(
+            "ScatterplotLayer",
+            df_map,
+            get_position=["lon", "lat"],
+            get_radius="radius",
+            get_fill_color="color",
+            radius_min_pixels=6,
+            radius_max_pixels=30,
+            pickable=True,
+        )
+        view = pdk.ViewState(
+            latitude=float(df_map["lat"].mean()) if not df_map.empty else 22.0,
+            longitude=float(df_map["lon"].mean()) if not df_map.empty else 79.0,
+            zoom=4,
+        )
+        st.pydeck_chart(
+            pdk.Deck(layers=[layer], initial_view_state=view, tooltip={"html": "{tooltip}"}, map_style=None),
+            use_container_width=True,
         )
-        fig.update_geos(projection_type="natural earth", showcountries=True, showland=True, fitbounds="locations")
-        fig.update_layout(template="plotly_dark", margin=dict(l=0, r=0, t=0, b=0))
-        st.plotly_chart(fig, use_container_width=True)
 
         st.markdown("### Export Last Snapshot")
         download_button(
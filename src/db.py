@@ -0,0 +1,54 @@
+import os
+import sqlite3
+
+# Single database file for all cities
+DB_PATH = os.path.join(os.path.dirname(__file__), "..", "db", "air_quality.db")
+
+# Table definitions live in a static .sql file rather than Python-embedded DDL
+SCHEMA_PATH = os.path.join(os.path.dirname(__file__), "..", "sql", "sqlite_schema.sql")
+with open(SCHEMA_PATH, encoding="utf-8") as f:
+    SCHEMA_SQL = f.read()
+
+# WAL + synchronous=NORMAL: no fsync per commit, readers don't block the writer
+SQLITE_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA busy_timeout=5000",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA mmap_size=268435456",  # 256 MB
+    "PRAGMA cache_size=-65536",    # 64 MB
+)
+
+def connect(path=DB_PATH):
+    """sqlite3.connect with the shared PRAGMA set; use this for every connection."""
+    conn = sqlite3.connect(path)
+    for pragma in SQLITE_PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
+# Read-only scans (training, migration): cache/mmap tuning only. No journal_mode or
+# synchronous, so reading never converts a database file to WAL
+SQLITE_READ_PRAGMAS = (
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA mmap_size=268435456",  # 256 MB
+    "PRAGMA cache_size=-65536",    # 64 MB
+    "PRAGMA query_only=1",
+)
+
+def connect_readonly(path=DB_PATH):
+    """sqlite3.connect for read-only use; leaves the file's journal mode untouched."""
+    conn = sqlite3.connect(path)
+    for pragma in SQLITE_READ_PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
+def ensure_schema(conn):
+    """Create tables/indexes if missing (idempotent), all DDL in one transaction
+    so it costs a single commit however many statements the schema grows to."""
+    conn.executescript(f"BEGIN IMMEDIATE;\n{SCHEMA_SQL}\nCOMMIT;")
+
+if __name__ == "__main__":
+    conn = connect(DB_PATH)
+    ensure_schema(conn)
+    conn.close()
+    print(f"✅ Database initialized at {DB_PATH}")
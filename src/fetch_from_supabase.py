@@ -1,10 +1,16 @@
 # fetch_from_supabase.py
 
 import os
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
 import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
 from supabase import create_client
 from dotenv import load_dotenv
 
+from db import SCHEMA_SQL
+
 # Load environment variables
 load_dotenv()
 supabase_url = os.getenv("SUPABASE_URL")
@@ -15,32 +21,75 @@ supabase = create_client(supabase_url, supabase_key)
 # Config
 TABLE_NAME = "air_quality_data"
 BATCH_SIZE = 1000
+MAX_WORKERS = 8  # concurrent range requests
+
+# REAL (measurement) columns of the table, read from its DDL in sql/sqlite_schema.sql
+_ddl = sqlite3.connect(":memory:")
+_ddl.executescript(SCHEMA_SQL)
+REAL_COLS = frozenset(r[1] for r in _ddl.execute(f"PRAGMA table_info({TABLE_NAME})") if r[2] == "REAL")
+_ddl.close()
+
+def batch_table(rows):
+    """One page of rows -> Arrow table (datetime_utc parsed)."""
+    df = pd.DataFrame(rows)
+    if "datetime_utc" in df.columns:
+        df["datetime_utc"] = pd.to_datetime(df["datetime_utc"], errors="coerce")
+    return pa.Table.from_pandas(df, preserve_index=False)
+
+
+def widen(schema):
+    """Pin the first page's Arrow types to the table's column types, so a first
+    page that happens to be all-null or all-integer doesn't break later pages:
+    REAL columns -> float64, any other all-null column -> string."""
+    fields = []
+    for f in schema:
+        if f.name in REAL_COLS and (pa.types.is_null(f.type) or pa.types.is_integer(f.type)):
+            f = f.with_type(pa.float64())
+        elif pa.types.is_null(f.type):
+            f = f.with_type(pa.string())
+        fields.append(f)
+    return pa.schema(fields)
+
+
+def fetch_page(offset):
+    """One ordered page; the ordering keeps range() pages disjoint and the output sorted."""
+    return (
+        supabase.table(TABLE_NAME)
+        .select("*")
+        .order("datetime_utc")
+        .order("id")
+        .range(offset, offset + BATCH_SIZE - 1)
+        .execute()
+        .data
+    )
+
 
 print("📥 Fetching data from Supabase in batches...")
-all_data = []
-offset = 0
-
-while True:
-    # Get rows in batches
-    response = supabase.table(TABLE_NAME).select("*").range(offset, offset + BATCH_SIZE - 1).execute()
-    
-    if not response.data:  # No more rows
-        break
-    
-    all_data.extend(response.data)
-    offset += BATCH_SIZE
-    print(f"✅ Retrieved {len(all_data)} rows so far...")
-
-# Convert to DataFrame
-df = pd.DataFrame(all_data)
-print(f"🎯 Total rows fetched: {len(df)}")
-
-# Sort by datetime_utc if present
-if "datetime_utc" in df.columns:
-    df["datetime_utc"] = pd.to_datetime(df["datetime_utc"], errors="coerce")
-    df.sort_values(by="datetime_utc", inplace=True)
-
-# Save locally in Parquet format
 output_file = "air_quality_raw.parquet"
-df.to_parquet(output_file, index=False)
+writer = None
+total = 0
+
+count = supabase.table(TABLE_NAME).select("id", count="exact").limit(1).execute().count or 0
+offsets = list(range(0, count, BATCH_SIZE))
+
+# Up to MAX_WORKERS pages in flight at a time; map() yields them in offset order,
+# so each window is written straight to Parquet and memory stays O(window).
+with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+    for start in range(0, len(offsets), MAX_WORKERS):
+        for rows in executor.map(fetch_page, offsets[start:start + MAX_WORKERS]):
+            if not rows:
+                continue
+
+            table = batch_table(rows)
+            if writer is None:
+                schema = widen(table.schema)
+                writer = pq.ParquetWriter(output_file, schema)
+            writer.write_table(table.cast(schema))
+
+            total += len(rows)
+        print(f"✅ Retrieved {total} rows so far...")
+
+if writer is not None:
+    writer.close()
+print(f"🎯 Total rows fetched: {total}")
 print(f"💾 Saved data locally to {output_file}")
@@ -1,11 +1,13 @@
-import os
-import sqlite3
 import requests
-import pandas as pd
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import numpy as np
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+
+from db import DB_PATH, connect, ensure_schema
 
 # === CONFIG ===
-DB_PATH = os.path.join(os.path.dirname(__file__), "..", "db", "air_quality.db")
 CITIES = {
     "Delhi": {"lat": 28.7041, "lon": 77.1025},
     "Mumbai": {"lat": 19.0760, "lon": 72.8777},
@@ -18,8 +20,26 @@ END_DATE = "2025-08-10"
 WEATHER_API = "https://archive-api.open-meteo.com/v1/archive"
 POLLUTANTS_API = "https://air-quality-api.open-meteo.com/v1/air-quality"
 
+# Shared keep-alive session: pooled connections + transport-level retries
+SESSION = requests.Session()
+SESSION.mount("https://", HTTPAdapter(
+    pool_connections=16, pool_maxsize=16,
+    max_retries=Retry(total=3, backoff_factor=0.5, status_forcelist=[429, 500, 502, 503, 504]),
+))
+
+
+# IST has no DST, so IST -> UTC is a fixed shift
+IST_OFFSET = np.timedelta64(330, "m")
+
+
+def ist_to_utc_str(times):
+    """IST wall-clock strings ('YYYY-MM-DDTHH:MM') -> 'YYYY-MM-DD HH:MM:SS' UTC strings,
+    shifted and formatted as one numpy array."""
+    utc = np.array(times, dtype="datetime64[m]") - IST_OFFSET
+    return np.char.replace(np.datetime_as_string(utc, unit="s"), "T", " ").tolist()
 
-def fetch_weather_data(city, lat, lon):
+
+def fetch_weather_data(lat, lon):
     params = {
         "latitude": lat,
         "longitude": lon,
@@ -38,19 +58,13 @@ def fetch_weather_data(city, lat, lon):
         ],
         "timezone": "Asia/Kolkata"
     }
-    r = requests.get(WEATHER_API, params=params)
+    r = SESSION.get(WEATHER_API, params=params)
     r.raise_for_status()
-    data = r.json()
-
-    df = pd.DataFrame(data["hourly"])
-    df.rename(columns={"time": "datetime_ist"}, inplace=True)
-    df["datetime_utc"] = pd.to_datetime(df["datetime_ist"]).dt.tz_localize("Asia/Kolkata").dt.tz_convert("UTC")
-    df["datetime_utc"] = df["datetime_utc"].dt.strftime("%Y-%m-%d %H:%M:%S")
-    df["city"] = city
-    return df
+    # Column dict straight from the JSON: {"time": [...], "<field>": [...], ...}
+    return r.json()["hourly"]
 
 
-def fetch_pollutants_data(city, lat, lon):
+def fetch_pollutants_data(lat, lon):
     params = {
         "latitude": lat,
         "longitude": lon,
@@ -71,39 +85,58 @@ def fetch_pollutants_data(city, lat, lon):
         ],
         "timezone": "Asia/Kolkata"
     }
-    r = requests.get(POLLUTANTS_API, params=params)
+    r = SESSION.get(POLLUTANTS_API, params=params)
     r.raise_for_status()
-    data = r.json()
+    # Column dict straight from the JSON: {"time": [...], "<field>": [...], ...}
+    return r.json()["hourly"]
 
-    df = pd.DataFrame(data["hourly"])
-    df.rename(columns={"time": "datetime_ist"}, inplace=True)
-    df["datetime_utc"] = pd.to_datetime(df["datetime_ist"]).dt.tz_localize("Asia/Kolkata").dt.tz_convert("UTC")
-    df["datetime_utc"] = df["datetime_utc"].dt.strftime("%Y-%m-%d %H:%M:%S")
-    df["city"] = city
-    return df
 
+INSERT_COLS = [
+    "city", "datetime_utc", "datetime_ist",
+    "temperature_2m", "relative_humidity_2m", "dew_point_2m", "apparent_temperature",
+    "pressure_msl", "surface_pressure", "cloudcover", "windspeed_10m", "winddirection_10m",
+    "pm10", "pm2_5", "carbon_monoxide", "carbon_dioxide", "nitrogen_dioxide",
+    "sulphur_dioxide", "ozone", "uv_index", "uv_index_clear_sky", "ammonia", "methane"
+]
 
-def insert_into_db(df):
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
 
-    cols = [
-        "city", "datetime_utc", "datetime_ist",
-        "temperature_2m", "relative_humidity_2m", "dew_point_2m", "apparent_temperature",
-        "pressure_msl", "surface_pressure", "cloudcover", "windspeed_10m", "winddirection_10m",
-        "pm10", "pm2_5", "carbon_monoxide", "carbon_dioxide", "nitrogen_dioxide",
-        "sulphur_dioxide", "ozone", "uv_index", "uv_index_clear_sky", "ammonia", "methane"
-    ]
+def _align(hourly, times):
+    """Reindex an hourly column dict onto `times` (missing hours -> None)."""
+    if hourly["time"] == times:
+        return hourly
+    idx = {t: i for i, t in enumerate(hourly["time"])}
+    return {k: [v[idx[t]] if t in idx else None for t in times] for k, v in hourly.items()}
+
+
+def build_rows(city, weather, pollutants):
+    """Zip both APIs' hourly columns into INSERT_COLS-ordered tuples, no DataFrame.
+    Both archives share Open-Meteo's hourly grid, so alignment is normally a no-op;
+    otherwise rows are outer-joined on the timestamp."""
+    times = weather["time"]
+    if pollutants["time"] != times:
+        times = sorted(set(weather["time"]) | set(pollutants["time"]))
+        weather, pollutants = _align(weather, times), _align(pollutants, times)
+
+    n = len(times)
+    columns = [[city] * n, ist_to_utc_str(times), times]
+    for col in INSERT_COLS[3:]:
+        columns.append(weather.get(col) or pollutants.get(col) or [None] * n)
+    return list(zip(*columns))
+
+
+def insert_into_db(rows):
+    conn = connect(DB_PATH)
+    cursor = conn.cursor()
 
     insert_query = f"""
     INSERT OR IGNORE INTO air_quality_data
-    ({", ".join(cols)})
-    VALUES ({", ".join(["?"] * len(cols))});
+    ({", ".join(INSERT_COLS)})
+    VALUES ({", ".join(["?"] * len(INSERT_COLS))});
     """
 
-    for _, row in df.iterrows():
-        cursor.execute(insert_query, [row.get(col) for col in cols])
-
+    # One executemany in a single transaction
+    conn.execute("BEGIN")
+    cursor.executemany(insert_query, rows)
     conn.commit()
     conn.close()
 
@@ -111,20 +144,26 @@ def insert_into_db(df):
 if __name__ == "__main__":
     all_data = []
 
-    for city, coords in CITIES.items():
-        print(f"📥 Fetching weather data for {city}...")
-        weather_df = fetch_weather_data(city, coords["lat"], coords["lon"])
-        print(f"📥 Fetching pollutants data for {city}...")
-        pollutants_df = fetch_pollutants_data(city, coords["lat"], coords["lon"])
-
-        # Merge on city + datetime_utc
-        merged_df = pd.merge(
-            weather_df, pollutants_df,
-            on=["city", "datetime_utc", "datetime_ist"],
-            how="outer"
-        )
-
-        print(f"✅ {city}: {len(merged_df)} rows")
-        insert_into_db(merged_df)
+    # Create the table once per run (not on every insert)
+    conn = connect(DB_PATH)
+    ensure_schema(conn)
+    conn.close()
+
+    # All weather + pollutant requests go out concurrently; SQLite writes stay
+    # on the main thread.
+    with ThreadPoolExecutor(max_workers=2 * len(CITIES)) as executor:
+        futures = {}
+        for city, coords in CITIES.items():
+            print(f"📥 Fetching weather + pollutants data for {city}...")
+            futures[city] = (
+                executor.submit(fetch_weather_data, coords["lat"], coords["lon"]),
+                executor.submit(fetch_pollutants_data, coords["lat"], coords["lon"]),
+            )
+
+        for city, (weather_f, pollutants_f) in futures.items():
+            rows = build_rows(city, weather_f.result(), pollutants_f.result())
+
+            print(f"✅ {city}: {len(rows)} rows")
+            insert_into_db(rows)
 
     print("🎯 Data collection complete. All records stored in SQLite DB.")
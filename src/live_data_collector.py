@@ -1,6 +1,9 @@
 import os
 import time
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from supabase import create_client, Client
 from dotenv import load_dotenv
 from datetime import datetime, timezone, timedelta
@@ -21,26 +24,58 @@ CITIES = {
     "Hyderabad": (17.3850, 78.4867),
 }
 
+# Hourly fields requested from each API (and copied into every record)
+WEATHER_FIELDS = (
+    "temperature_2m",
+    "relative_humidity_2m",
+    "dew_point_2m",
+    "apparent_temperature",
+    "pressure_msl",
+    "surface_pressure",
+    "cloudcover",
+    "windspeed_10m",
+    "winddirection_10m",
+    "uv_index",
+    "uv_index_clear_sky",
+)
+POLLUTANT_FIELDS = (
+    "pm10",
+    "pm2_5",
+    "carbon_monoxide",
+    "carbon_dioxide",
+    "nitrogen_dioxide",
+    "sulphur_dioxide",
+    "ozone",
+    "methane",
+)
+
 supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
 
+# Shared keep-alive session: pooled connections + transport-level retries
+SESSION = requests.Session()
+SESSION.mount("https://", HTTPAdapter(
+    pool_connections=16, pool_maxsize=16,
+    max_retries=Retry(total=3, backoff_factor=0.5, status_forcelist=[429, 500, 502, 503, 504]),
+))
+
+IST_TZ = timezone(timedelta(hours=5, minutes=30))
+
 # Fetch only last 2 hours
 now_utc = datetime.now(timezone.utc).replace(microsecond=0)
 start_utc = now_utc - timedelta(hours=2)
 
 # --------------------
-# Retry-enabled Fetch Function
+# Fetch Function (retries handled by SESSION's adapter)
 # --------------------
-def fetch_with_retry(url, params, retries=3, delay=5, label="API"):
-    for attempt in range(1, retries + 1):
-        try:
-            r = requests.get(url, params=params, timeout=15)
-            r.raise_for_status()
-            return r.json()
-        except requests.exceptions.Timeout:
-            print(f"⏳ {label} timeout (attempt {attempt}/{retries})")
-        except requests.exceptions.RequestException as e:
-            print(f"⚠️ {label} fetch error: {e} (attempt {attempt}/{retries})")
-        time.sleep(delay)
+def fetch_with_retry(url, params, label="API"):
+    try:
+        r = SESSION.get(url, params=params, timeout=15)
+        r.raise_for_status()
+        return r.json()
+    except requests.exceptions.Timeout:
+        print(f"⏳ {label} timeout")
+    except requests.exceptions.RequestException as e:
+        print(f"⚠️ {label} fetch error: {e}")
     return None
 
 # --------------------
@@ -51,19 +86,7 @@ def fetch_weather(lat, lon, start, end):
     params = {
         "latitude": lat,
         "longitude": lon,
-        "hourly": ",".join([
-            "temperature_2m",
-            "relative_humidity_2m",
-            "dew_point_2m",
-            "apparent_temperature",
-            "pressure_msl",
-            "surface_pressure",
-            "cloudcover",
-            "windspeed_10m",
-            "winddirection_10m",
-            "uv_index",
-            "uv_index_clear_sky"
-        ]),
+        "hourly": ",".join(WEATHER_FIELDS),
         "start": start.isoformat(timespec="minutes"),
         "end": end.isoformat(timespec="minutes"),
         "timezone": "UTC"
@@ -75,16 +98,7 @@ def fetch_pollutants(lat, lon, start, end):
     params = {
         "latitude": lat,
         "longitude": lon,
-        "hourly": ",".join([
-            "pm10",
-            "pm2_5",
-            "carbon_monoxide",
-            "carbon_dioxide",
-            "nitrogen_dioxide",
-            "sulphur_dioxide",
-            "ozone",
-            "methane"
-        ]),
+        "hourly": ",".join(POLLUTANT_FIELDS),
         "start": start.isoformat(timespec="minutes"),
         "end": end.isoformat(timespec="minutes"),
         "timezone": "UTC"
@@ -96,84 +110,97 @@ def fetch_pollutants(lat, lon, start, end):
 # --------------------
 def merge_data(city, weather, pollutants):
     now_utc_str = now_utc.isoformat()
-    timestamps_weather = weather["hourly"]["time"]
-    timestamps_pollutants = pollutants["hourly"]["time"]
+    wh = weather["hourly"]
+    ph = pollutants["hourly"]
+    # timestamp -> row index, built once (list.index per timestamp was O(N^2))
+    wi = {t: i for i, t in enumerate(wh["time"])}
+    pi = {t: i for i, t in enumerate(ph["time"])}
+
+    valid_times = sorted(t for t in wi.keys() & pi.keys() if t <= now_utc_str)
+    ist_strs = {
+        t: datetime.fromisoformat(t.replace("Z", "+00:00")).astimezone(IST_TZ).isoformat()
+        for t in valid_times
+    }
 
-    valid_times = sorted(
-        t for t in set(timestamps_weather) & set(timestamps_pollutants)
-        if t <= now_utc_str
-    )
+    # Resolve each hourly array once; the loop only indexes local lists
+    w_cols = [(f, wh[f]) for f in WEATHER_FIELDS]
+    p_cols = [(f, ph[f]) for f in POLLUTANT_FIELDS]
 
     merged_records = []
     for t in valid_times:
-        idx_w = timestamps_weather.index(t)
-        idx_p = timestamps_pollutants.index(t)
-        merged_records.append({
-            "city": city,
-            "datetime_utc": t,
-            "datetime_ist": (
-                datetime.fromisoformat(t.replace("Z", "+00:00"))
-                .astimezone(timezone(timedelta(hours=5, minutes=30)))
-                .isoformat()
-            ),
-            "temperature_2m": weather["hourly"]["temperature_2m"][idx_w],
-            "relative_humidity_2m": weather["hourly"]["relative_humidity_2m"][idx_w],
-            "dew_point_2m": weather["hourly"]["dew_point_2m"][idx_w],
-            "apparent_temperature": weather["hourly"]["apparent_temperature"][idx_w],
-            "pressure_msl": weather["hourly"]["pressure_msl"][idx_w],
-            "surface_pressure": weather["hourly"]["surface_pressure"][idx_w],
-            "cloudcover": weather["hourly"]["cloudcover"][idx_w],
-            "windspeed_10m": weather["hourly"]["windspeed_10m"][idx_w],
-            "winddirection_10m": weather["hourly"]["winddirection_10m"][idx_w],
-            "pm10": pollutants["hourly"]["pm10"][idx_p],
-            "pm2_5": pollutants["hourly"]["pm2_5"][idx_p],
-            "carbon_monoxide": pollutants["hourly"]["carbon_monoxide"][idx_p],
-            "carbon_dioxide": pollutants["hourly"]["carbon_dioxide"][idx_p],
-            "nitrogen_dioxide": pollutants["hourly"]["nitrogen_dioxide"][idx_p],
-            "sulphur_dioxide": pollutants["hourly"]["sulphur_dioxide"][idx_p],
-            "ozone": pollutants["hourly"]["ozone"][idx_p],
-            "uv_index": weather["hourly"]["uv_index"][idx_w],
-            "uv_index_clear_sky": weather["hourly"]["uv_index_clear_sky"][idx_w],
-            "methane": pollutants["hourly"]["methane"][idx_p],
-        })
+        idx_w = wi[t]
+        idx_p = pi[t]
+        rec = {"city": city, "datetime_utc": t, "datetime_ist": ist_strs[t]}
+        rec.update({f: col[idx_w] for f, col in w_cols})
+        rec.update({f: col[idx_p] for f, col in p_cols})
+        merged_records.append(rec)
     return merged_records
 
 # --------------------
 # Insert into Supabase
 # --------------------
+def _as_utc(ts):
+    """Parse an ISO timestamp (naive values are UTC) to an aware datetime."""
+    dt = datetime.fromisoformat(ts.replace("Z", "+00:00"))
+    return dt if dt.tzinfo else dt.replace(tzinfo=timezone.utc)
+
+def newer_than_stored(city, records):
+    """Drop records at or before the city's latest stored datetime_utc, so steady-state
+    runs only POST the new hour(s) instead of the whole window."""
+    latest = supabase.table(TABLE_NAME).select("datetime_utc")\
+        .eq("city", city)\
+        .order("datetime_utc", desc=True)\
+        .limit(1)\
+        .execute().data
+    if not latest:
+        return records
+    cutoff = _as_utc(latest[0]["datetime_utc"])
+    return [r for r in records if _as_utc(r["datetime_utc"]) > cutoff]
+
 def insert_if_new(records):
-    new_recs = []
-    for rec in records:
-        exists = supabase.table(TABLE_NAME).select("id")\
-            .eq("city", rec["city"])\
-            .eq("datetime_utc", rec["datetime_utc"])\
-            .execute()
-        if len(exists.data) == 0:
-            new_recs.append(rec)
-    if new_recs:
-        supabase.table(TABLE_NAME).insert(new_recs).execute()
-    return len(new_recs), len(records)
+    # ON CONFLICT (city, datetime_utc) DO NOTHING: one round-trip instead of a
+    # SELECT per record; only the rows actually inserted come back.
+    if not records:
+        return 0, 0
+    resp = supabase.table(TABLE_NAME).upsert(
+        records, on_conflict="city,datetime_utc", ignore_duplicates=True
+    ).execute()
+    return len(resp.data or []), len(records)
 
 # --------------------
-# MAIN SCRIPT
+# Per-city collection
 # --------------------
-print(f"🚀 Starting live data update ({start_utc.isoformat()} → {now_utc.isoformat()})")
-
-for city, (lat, lon) in CITIES.items():
+def collect_city(city, lat, lon):
+    """Fetch weather + pollutants concurrently and merge them (up to 3 attempts)."""
     for attempt in range(1, 4):  # Up to 3 retries per city
         print(f"\n📡 Fetching data for {city} (attempt {attempt}/3)...")
-        weather = fetch_weather(lat, lon, start_utc, now_utc)
-        pollutants = fetch_pollutants(lat, lon, start_utc, now_utc)
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            weather_f = executor.submit(fetch_weather, lat, lon, start_utc, now_utc)
+            pollutants_f = executor.submit(fetch_pollutants, lat, lon, start_utc, now_utc)
+            weather, pollutants = weather_f.result(), pollutants_f.result()
 
         if weather and pollutants:
-            merged = merge_data(city, weather, pollutants)
-            inserted, checked = insert_if_new(merged)
-            print(f"✅ {city}: {inserted} new records inserted ({checked} checked)")
-            break
-        else:
-            print(f"⚠️ {city} fetch failed, retrying...")
-            time.sleep(5)
-    else:
-        print(f"❌ Skipping {city} after 3 failed attempts.")
+            return merge_data(city, weather, pollutants)
+        print(f"⚠️ {city} fetch failed, retrying...")
+        time.sleep(5)
+    return None
+
+# --------------------
+# MAIN SCRIPT
+# --------------------
+print(f"🚀 Starting live data update ({start_utc.isoformat()} → {now_utc.isoformat()})")
+
+# Fetch all cities in parallel; Supabase writes stay on the main thread
+with ThreadPoolExecutor(max_workers=len(CITIES)) as executor:
+    futures = {executor.submit(collect_city, city, lat, lon): city for city, (lat, lon) in CITIES.items()}
+    for fut in as_completed(futures):
+        city = futures[fut]
+        merged = fut.result()
+        if merged is None:
+            print(f"❌ Skipping {city} after 3 failed attempts.")
+            continue
+        fresh = newer_than_stored(city, merged)
+        inserted, _ = insert_if_new(fresh)
+        print(f"✅ {city}: {inserted} new records inserted ({len(merged)} checked)")
 
 print("\n🎉 Live data collection completed!")
@@ -1,4 +1,6 @@
+import functools
 import os
+import time
 import pandas as pd
 from supabase import create_client, Client
 from dotenv import load_dotenv
@@ -9,26 +11,77 @@ load_dotenv()
 SUPABASE_URL = os.getenv("SUPABASE_URL")
 SUPABASE_KEY = os.getenv("SUPABASE_SERVICE_KEY")
 
+# Rows per request; matches PostgREST's default max-rows cap
+PAGE_SIZE = 1000
+
+# Known city names, lowercased -> stored spelling, refreshed every CITY_CACHE_TTL s
+CITY_CACHE_TTL = 300
+_city_cache: tuple[float, dict[str, str]] = (float("-inf"), {})
+
+# One client (and HTTP session) per process, not a new TLS handshake per call
+@functools.lru_cache(maxsize=1)
 def get_supabase_client() -> Client:
     return create_client(SUPABASE_URL, SUPABASE_KEY)
 
-def fetch_data(table: str, limit: int = 1000) -> pd.DataFrame:
-    """Fetch data from a Supabase table"""
-    supabase = get_supabase_client()
-    data = (
-        supabase.table(table)
-        .select("*")
-        .order("datetime_utc", desc=True)
-        .limit(limit)
-        .execute()
-    )
-    if not data.data:
+def fetch_data(table: str, limit: int = 1000, client: Client | None = None,
+               city: str | None = None, columns: tuple[str, ...] | None = None) -> pd.DataFrame:
+    """Fetch the latest `limit` rows from a Supabase table (reuses `client` when given).
+
+    Paged with range() so limits above the PostgREST max-rows cap aren't
+    silently truncated. `city` is an exact server-side filter on the stored name.
+    `columns` projects the select (default: every column); e.g. pass
+    ("city", "datetime_utc", "aqi", "aqi_category", "dominant_pollutant")
+    when reading aqi_results for display rather than all the prediction and
+    latest_* columns.
+    """
+    supabase = client or get_supabase_client()
+    select = ",".join(columns) if columns else "*"
+    rows: list[dict] = []
+    offset = 0
+
+    while offset < limit:
+        end = min(offset + PAGE_SIZE, limit) - 1
+        query = supabase.table(table).select(select)
+        if city is not None:
+            query = query.eq("city", city)
+        resp = (
+            query
+            .order("datetime_utc", desc=True)
+            .order("city")  # (city, datetime_utc) is unique -> stable pages
+            .range(offset, end)
+            .execute()
+        )
+        page = resp.data or []
+        rows.extend(page)
+        if len(page) < end - offset + 1:
+            break
+        offset += len(page)
+
+    if not rows:
+        return pd.DataFrame()
+    # PostgREST rows all share the select's keys: take them from the first row
+    # instead of letting pandas union the keys of every dict
+    return pd.DataFrame.from_records(rows, columns=list(rows[0]))
+
+def resolve_city(city: str, client: Client | None = None) -> str | None:
+    """Stored spelling of `city` (case-insensitive), or None if no data has it.
+
+    Names come from the data via the `cities_since` RPC (sql/cities_since.sql),
+    so cities the pipeline discovers are found without a hardcoded list.
+    """
+    global _city_cache
+    loaded_at, cities = _city_cache
+    if time.monotonic() - loaded_at > CITY_CACHE_TTL:
+        supabase = client or get_supabase_client()
+        resp = supabase.rpc("cities_since", {"ts": "-infinity"}).execute()
+        cities = {r["city"].lower(): r["city"] for r in (resp.data or []) if r.get("city")}
+        _city_cache = (time.monotonic(), cities)
+    return cities.get(city.lower())
+
+def fetch_city_predictions(city: str, limit: int = 100, client: Client | None = None,
+                           columns: tuple[str, ...] | None = None) -> pd.DataFrame:
+    """Fetch the latest AQI results for a city (name matched case-insensitively)"""
+    canonical = resolve_city(city, client=client)
+    if canonical is None:
         return pd.DataFrame()
-    return pd.DataFrame(data.data)
-
-def fetch_city_predictions(city: str, limit: int = 100) -> pd.DataFrame:
-    """Fetch AQI results for a city"""
-    df = fetch_data("aqi_results", limit=limit)
-    if df.empty:
-        return df
-    return df[df["city"].str.lower() == city.lower()]
+    return fetch_data("aqi_results", limit=limit, client=client, city=canonical, columns=columns)